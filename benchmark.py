@@ -0,0 +1,425 @@
+# This script benchmarks building the model, extracting the targets and
+# painting over a matrix of image sizes and style layers, and writes the
+# results to a .json file so that runs can be compared
+#
+# usage: python benchmark.py [--weights imagenet-vgg-verydeep-19/]
+#                            [--output benchmark.json] [--compare old.json]
+#                            [--precision] [--memory]
+#
+# Without --weights a synthetic weight store with the shapes of VGG19 is
+# generated, so no download is needed. Timings do not depend on the values
+# of the weights, only the painted images do.
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+from vgg_helper import write_weight_store, convert_weight_store
+from vgg_model import load_vgg_model, load_vgg_weights, model_layers, extract_targets
+from vgg_model import generate_noise_image, deprocess_image, VGG_LAYERS, CONTENT_LAYER, STYLE_LAYERS
+from stylize import Targets, loss_terms_func, AdamPainter
+
+
+# Folder of the generated synthetic weight store.
+SYNTHETIC_STORE = 'synthetic-vgg-19/'
+# Output channels of the conv layers of every VGG19 block.
+BLOCK_CHANNELS = {'1': 64, '2': 128, '3': 256, '4': 512, '5': 512}
+# Image sizes, as (height, width), and style layer sets benchmarked.
+BENCH_SIZES = [(150, 200), (300, 400), (600, 800)]
+BENCH_STYLE_LAYERS = {
+    'default': STYLE_LAYERS,
+    'shallow': [('conv1_1', 1.0 / 3), ('conv2_1', 1.0 / 3), ('conv3_1', 1.0 / 3)],
+}
+# Adam steps run before timing, and timed.
+WARMUP_ITERATIONS = 3
+BENCH_ITERATIONS = 20
+# Each per layer forward and backward measure is the best of this many runs.
+LAYER_REPEATS = 3
+# (store precision, model precision) pairs compared by precision_report,
+# the first one is the baseline.
+PRECISION_VARIANTS = [
+    ('float32', 'float32'),
+    ('float16', 'float16'),
+    ('int8', 'float32'),
+    ('int8', 'float16'),
+    ('float32', 'bfloat16'),
+]
+# Image sizes, as (height, width), at which memory_report compares the
+# gradient with and without recomputation.
+MEMORY_SIZES = [(300, 400), (600, 800)]
+
+
+def make_synthetic_weights(store_dir=SYNTHETIC_STORE, seed=0):
+    """
+    Writes a weight store with the layer names, indices and shapes of VGG19
+    filled with He initialized random weights, and returns store_dir.
+    """
+    rng = np.random.RandomState(seed)
+    conv_weights = {}
+    channels = 3
+    for layer_name, layer_index in VGG_LAYERS:
+        if not layer_name.startswith('conv'):
+            continue
+        out_channels = BLOCK_CHANNELS[layer_name[4]]
+        W = rng.randn(3, 3, channels, out_channels) * np.sqrt(2.0 / (9 * channels))
+        b = np.zeros(out_channels)
+        conv_weights[layer_index] = (layer_name, W, b)
+        channels = out_channels
+    write_weight_store(conv_weights, store_dir)
+    return store_dir
+
+
+def _best_time(sess, fetches, repeats):
+    """
+    Returns the shortest of repeats runs of fetches, in seconds.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        sess.run(fetches)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def layer_costs(sess, model, repeats=LAYER_REPEATS):
+    """
+    Returns a list of (layer name, forward seconds, backward seconds) for
+    every layer of model. A layer's cost is the time to run the network up
+    to it minus the time to run it up to the previous layer.
+    """
+    layer_names = [layer_name for layer_name, _ in VGG_LAYERS if layer_name in model]
+    costs = []
+    previous_forward = 0.0
+    previous_backward = 0.0
+    for layer_name in layer_names:
+        layer = model[layer_name]
+        gradient = tf.gradients(tf.reduce_sum(layer), model['input'])[0]
+        # The first run of an op includes its setup.
+        sess.run(gradient)
+        forward = _best_time(sess, layer, repeats)
+        # The gradient runs the forward pass as well.
+        backward = _best_time(sess, gradient, repeats) - forward
+        costs.append((layer_name, forward - previous_forward, backward - previous_backward))
+        previous_forward = forward
+        previous_backward = backward
+    return costs
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def bench_config(weights_path, height, width, style_layers, iterations=BENCH_ITERATIONS,
+                 warmup=WARMUP_ITERATIONS, content_layer=CONTENT_LAYER):
+    """
+    Benchmarks one image size and set of style layers, and returns the
+    results as a dict of times in seconds.
+    """
+    result = {'height': height, 'width': width,
+              'style_layers': [layer_name for layer_name, _ in style_layers]}
+    rng = np.random.RandomState(0)
+    content_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+    style_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        start = time.time()
+        weights = load_vgg_weights(weights_path)
+        model = load_vgg_model(weights, model_layers(content_layer, style_layers),
+                               height=height, width=width)
+        sess.run(model['input'].initializer)
+        result['build'] = time.time() - start
+
+        start = time.time()
+        content_features, grams = extract_targets(sess, model, content_image, style_image,
+                                                  content_layer, style_layers)
+        result['extract_first'] = time.time() - start
+        start = time.time()
+        extract_targets(sess, model, content_image, style_image, content_layer, style_layers)
+        result['extract'] = time.time() - start
+
+        start = time.time()
+        targets = Targets(model, content_layer, style_layers)
+        loss_terms = loss_terms_func(sess, model, targets.content, targets.grams,
+                                     content_layer=content_layer, style_layers=style_layers)
+        painter = AdamPainter(sess, model, loss_terms)
+        targets.load(sess, content_features, grams)
+        result['build_painter'] = time.time() - start
+
+        initial_image = generate_noise_image(content_image)
+        painter.run(initial_image, warmup)
+        start = time.time()
+        painter.run(initial_image, iterations)
+        elapsed = time.time() - start
+        result['iterations'] = iterations
+        result['iterations_per_second'] = iterations / elapsed
+
+        result['layers'] = [{'layer': layer_name, 'forward': forward, 'backward': backward}
+                            for layer_name, forward, backward in layer_costs(sess, model)]
+    result['peak_rss'] = peak_rss()
+    return result
+
+
+def run_benchmarks(weights_path, sizes=BENCH_SIZES, style_layer_sets=BENCH_STYLE_LAYERS,
+                   iterations=BENCH_ITERATIONS, isolate=True):
+    """
+    Benchmarks every size with every set of style layers and returns the
+    report. With isolate every configuration runs in a fresh process, so
+    that its peak memory is its own.
+    """
+    results = []
+    pool = None
+    if isolate:
+        pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    try:
+        for height, width in sizes:
+            for set_name in sorted(style_layer_sets):
+                args = (weights_path, height, width, style_layer_sets[set_name], iterations)
+                if pool is not None:
+                    result = pool.apply(bench_config, args)
+                else:
+                    result = bench_config(*args)
+                result['style_set'] = set_name
+                print('%dx%d %s: build %.2fs, extract %.3fs, %.2f it/s, peak %.0fMB' % (
+                    height, width, set_name, result['build'], result['extract'],
+                    result['iterations_per_second'], result['peak_rss'] / 2.0 ** 20))
+                results.append(result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'tensorflow': tf.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'weights': weights_path,
+        'results': results,
+    }
+
+
+def _store_bytes(store_dir):
+    """
+    Returns the size of the files of a weight store.
+    """
+    return sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir))
+
+
+def precision_report(weights_path, variants=PRECISION_VARIANTS, height=300, width=400,
+                     iterations=BENCH_ITERATIONS, warmup=WARMUP_ITERATIONS,
+                     content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS):
+    """
+    Paints the same image from the same start with every (store precision,
+    model precision) of variants and returns their speed and quality
+    against the first variant, the float32 baseline: iterations per
+    second, speedup, the PSNR of the painted image and its total loss
+    evaluated by the float32 model, relative to the baseline's.
+    weights_path must be a float32 weight store; the stores of other
+    precisions are written next to it once.
+    """
+    rng = np.random.RandomState(0)
+    content_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+    style_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+    initial_image = generate_noise_image(content_image)
+    layers = model_layers(content_layer, style_layers)
+
+    results = []
+    for store_precision, model_precision in variants:
+        store_dir = weights_path
+        if store_precision != 'float32':
+            store_dir = os.path.normpath(weights_path) + '-' + store_precision + '/'
+            if not os.path.exists(os.path.join(store_dir, 'index.json')):
+                convert_weight_store(weights_path, store_dir, store_precision)
+        with tf.Graph().as_default(), tf.Session() as sess:
+            model = load_vgg_model(store_dir, layers, height=height, width=width,
+                                   precision=model_precision)
+            sess.run(model['input'].initializer)
+            content_features, grams = extract_targets(sess, model, content_image, style_image,
+                                                      content_layer, style_layers)
+            loss_terms = loss_terms_func(sess, model, content_features, grams,
+                                         content_layer=content_layer, style_layers=style_layers)
+            painter = AdamPainter(sess, model, loss_terms)
+            painter.run(initial_image, warmup)
+            start = time.time()
+            image = painter.run(initial_image, iterations)
+            elapsed = time.time() - start
+        results.append({'store_precision': store_precision, 'model_precision': model_precision,
+                        'store_bytes': _store_bytes(store_dir),
+                        'iterations_per_second': iterations / elapsed, 'image': image})
+
+    # Every painted image is judged by the float32 model and targets.
+    with tf.Graph().as_default(), tf.Session() as sess:
+        model = load_vgg_model(weights_path, layers, height=height, width=width)
+        content_features, grams = extract_targets(sess, model, content_image, style_image,
+                                                  content_layer, style_layers)
+        total = loss_terms_func(sess, model, content_features, grams,
+                                content_layer=content_layer, style_layers=style_layers)['total']
+        for result in results:
+            sess.run(model['input'].assign(result['image']))
+            result['loss'] = float(sess.run(total))
+
+    baseline = results[0]
+    baseline_picture = deprocess_image(baseline['image']).astype(np.float64)
+    for result in results:
+        mse = np.mean((deprocess_image(result.pop('image')) - baseline_picture) ** 2)
+        result['psnr'] = float(10 * np.log10(255.0 ** 2 / mse)) if mse > 0 else None
+        result['speedup'] = result['iterations_per_second'] / baseline['iterations_per_second']
+        result['loss_ratio'] = result['loss'] / baseline['loss']
+    return results
+
+
+def step_memory(run_metadata):
+    """
+    Returns the most and the least bytes in use by the allocators during a
+    traced run, or (None, None) if the run recorded no memory use.
+    """
+    in_use = [memory.allocator_bytes_in_use
+              for device in run_metadata.step_stats.dev_stats
+              for node in device.node_stats
+              for memory in node.memory]
+    if not in_use:
+        return None, None
+    return max(in_use), min(in_use)
+
+
+def memory_report(weights_path, sizes=MEMORY_SIZES, iterations=BENCH_ITERATIONS,
+                  warmup=WARMUP_ITERATIONS, content_layer=CONTENT_LAYER,
+                  style_layers=STYLE_LAYERS):
+    """
+    Paints the same image from the same start at every size with and
+    without gradient recomputation, see vgg_model.RECOMPUTE_GRADIENTS, and
+    returns the memory and time of an Adam step of both: iterations per
+    second, the peak bytes in use during a step, and the bytes the step
+    adds to what is held between steps, mostly activations. Recomputing
+    rows also hold their ratios to the plain row of the same size, and the
+    largest difference of the painted image, which should be 0.
+    """
+    layers = model_layers(content_layer, style_layers)
+    results = []
+    for height, width in sizes:
+        rng = np.random.RandomState(0)
+        content_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+        style_image = rng.uniform(-20, 20, (1, height, width, 3)).astype(np.float32)
+        initial_image = generate_noise_image(content_image)
+        plain = None
+        for recompute in (False, True):
+            with tf.Graph().as_default(), tf.Session() as sess:
+                model = load_vgg_model(weights_path, layers, height=height, width=width,
+                                       recompute=recompute)
+                sess.run(model['input'].initializer)
+                content_features, grams = extract_targets(sess, model, content_image, style_image,
+                                                          content_layer, style_layers)
+                loss_terms = loss_terms_func(sess, model, content_features, grams,
+                                             content_layer=content_layer,
+                                             style_layers=style_layers)
+                painter = AdamPainter(sess, model, loss_terms)
+                painter.run(initial_image, warmup)
+                start = time.time()
+                image = painter.run(initial_image, iterations)
+                elapsed = time.time() - start
+                run_metadata = tf.RunMetadata()
+                sess.run(painter.train_step, run_metadata=run_metadata,
+                         options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+            peak, held = step_memory(run_metadata)
+            result = {'height': height, 'width': width, 'recompute': recompute,
+                      'iterations_per_second': iterations / elapsed, 'peak_bytes': peak,
+                      'step_bytes': None if peak is None else peak - held}
+            if plain is None:
+                plain = result
+                plain_image = image
+            else:
+                result['time_ratio'] = plain['iterations_per_second'] / result['iterations_per_second']
+                if peak is not None:
+                    result['peak_ratio'] = float(peak) / plain['peak_bytes']
+                    result['step_ratio'] = float(result['step_bytes']) / plain['step_bytes']
+                result['max_difference'] = float(np.abs(image - plain_image).max())
+            results.append(result)
+    return results
+
+
+def compare(report, baseline):
+    """
+    Prints the change of the main timings of report against baseline for
+    the configurations both ran.
+    """
+    def _key(result):
+        return (result['height'], result['width'], result['style_set'])
+
+    previous = dict((_key(result), result) for result in baseline['results'])
+    for result in report['results']:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        changes = []
+        for name in ('build', 'extract', 'iterations_per_second', 'peak_rss'):
+            changes.append('%s %+.1f%%' % (name, 100.0 * (result[name] / old[name] - 1)))
+        print('%dx%d %s: %s' % (result['height'], result['width'], result['style_set'],
+                                ', '.join(changes)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the style transfer.')
+    parser.add_argument('--weights', help='vgg weight store or .pkl, synthetic if not given')
+    parser.add_argument('--output', default='benchmark.json', help='report file')
+    parser.add_argument('--compare', help='report of an earlier run to compare against')
+    parser.add_argument('--iterations', type=int, default=BENCH_ITERATIONS)
+    parser.add_argument('--sizes', nargs='+', metavar='HxW',
+                        help='image sizes, e.g. 300x400')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every configuration in this process')
+    parser.add_argument('--precision', action='store_true',
+                        help='compare reduced precisions to float32 at the first size')
+    parser.add_argument('--memory', action='store_true',
+                        help='compare the memory and time of gradient recomputation')
+    args = parser.parse_args()
+
+    weights_path = args.weights
+    if weights_path is None:
+        weights_path = SYNTHETIC_STORE
+        if not os.path.exists(os.path.join(weights_path, 'index.json')):
+            make_synthetic_weights(weights_path)
+    sizes = BENCH_SIZES
+    if args.sizes:
+        sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes]
+
+    report = run_benchmarks(weights_path, sizes, iterations=args.iterations,
+                            isolate=not args.in_process)
+    if args.precision:
+        height, width = sizes[0]
+        report['precision'] = precision_report(weights_path, height=height, width=width,
+                                               iterations=args.iterations)
+        for result in report['precision']:
+            print('%s store, %s model: %.2fx speed, PSNR %s dB, loss x%.3f, store %.0fMB' % (
+                result['store_precision'], result['model_precision'], result['speedup'],
+                '-' if result['psnr'] is None else '%.1f' % result['psnr'],
+                result['loss_ratio'], result['store_bytes'] / 2.0 ** 20))
+    if args.memory:
+        report['memory'] = memory_report(weights_path, sizes if args.sizes else MEMORY_SIZES,
+                                         iterations=args.iterations)
+        for result in report['memory']:
+            if not result['recompute']:
+                continue
+            print('%dx%d recompute: %.2fx time, peak %s, step memory %s' % (
+                result['height'], result['width'], result['time_ratio'],
+                '-' if result['peak_bytes'] is None else 'x%.2f' % result['peak_ratio'],
+                '-' if result['step_bytes'] is None else 'x%.2f' % result['step_ratio']))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,59 @@
+# This script saves and loads the state of a painting run, so that a run
+# that was stopped, or that is given more iterations, goes on from where it
+# was instead of starting over from noise
+import os
+import json
+import numpy as np
+
+
+# Iterations between two checkpoints of a run.
+CHECKPOINT_EVERY = 100
+# Bumped whenever the content of a checkpoint changes.
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, names, values, step, history, info=None):
+    """
+    Writes a checkpoint to path, a single .npz file: the values of the
+    variables called names, the number of steps run, the loss history as
+    (step, loss) pairs and info, a dict of json values.
+    The checkpoint is written to a temporary file first, so a run stopped
+    while writing leaves the previous checkpoint whole.
+    """
+    meta = {
+        'version': CHECKPOINT_VERSION,
+        'names': list(names),
+        'step': int(step),
+        'info': info or {},
+    }
+    arrays = dict(('variable_%d' % n, np.asarray(value)) for n, value in enumerate(values))
+    arrays['history'] = np.array(history, dtype=np.float64).reshape(-1, 2)
+    arrays['meta'] = np.array(json.dumps(meta))
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Returns the checkpoint at path as a dict holding 'names', 'values',
+    'step', 'history' and 'info', see save_checkpoint.
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        if meta['version'] != CHECKPOINT_VERSION:
+            raise ValueError('Checkpoint %s has version %s, expected %d' % (
+                path, meta['version'], CHECKPOINT_VERSION))
+        values = [data['variable_%d' % n] for n in range(len(meta['names']))]
+        history = [(int(step), float(loss)) for step, loss in data['history']]
+    return {
+        'names': meta['names'],
+        'values': values,
+        'step': meta['step'],
+        'history': history,
+        'info': meta['info'],
+    }
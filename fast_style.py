@@ -0,0 +1,351 @@
+# This script trains a small image transformation network per style with
+# the losses of the paper, so that a style served all the time paints any
+# photo in a single forward pass instead of hundreds of optimizer steps
+#
+# usage: python fast_style.py train images/guernica.jpg photos/ styles/guernica.npz
+#                             [--size 256] [--iterations 40000]
+#                             [--model imagenet-vgg-verydeep-19/]
+#        python fast_style.py stylize styles/guernica.npz images/hongkong.jpg output/hongkong.png
+#
+# Styles painted once are still best painted by the optimization of
+# stylize.py, which needs no training.
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from vgg_model import load_vgg_model, model_layers, extract_targets, load_image, save_image
+from vgg_model import CONTENT_LAYER, STYLE_LAYERS, MEAN_VALUES, RESIZE_POLICY
+from stylize import loss_terms_func, ALPHA, BETA, REPORT_EVERY
+from feature_cache import FeatureCache, CACHE_DIR, CACHE_MAX_BYTES
+from checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_EVERY
+from ingest import Ingest, list_images, PREPROCESSING
+from progress import PrintObserver
+
+
+# Size of the training images, and how the photos are brought to it.
+TRAIN_HEIGHT = 256
+TRAIN_WIDTH = 256
+TRAIN_POLICY = 'crop'
+# Photos per training step, and number of training steps.
+BATCH_SIZE = 4
+TRAIN_ITERATIONS = 40000
+# Learning rate of the Adam optimizer training the network.
+TRAIN_LEARNING_RATE = 1e-3
+# Weight of the total variation of the stylized images, which smooths out
+# the high frequency noise the network otherwise learns.
+TV_WEIGHT = 1.0
+# Filters of the three downsampling convolutions of the network, mirrored
+# by the upsampling ones, and number of residual blocks between them. The
+# network of Johnson et al. uses 32, 64, 128 and 5 blocks; fewer filters
+# and blocks make it quicker to train on a CPU at a lower quality.
+FILTERS = (32, 64, 128)
+RESIDUAL_BLOCKS = 5
+
+
+def _conv_weights(rng, name, size, in_channels, out_channels):
+    """
+    Returns a He initialized convolution kernel variable.
+    """
+    W = rng.randn(size, size, in_channels, out_channels) * np.sqrt(2.0 / (size * size * in_channels))
+    return tf.Variable(W.astype(np.float32), name=name)
+
+
+def transform_net(images, filters=FILTERS, residual_blocks=RESIDUAL_BLOCKS, seed=0):
+    """
+    Returns the image transformation network of Johnson et al. applied to
+    images, a batch of mean subtracted images of any size, and the list of
+    its variables. The stylized images have the size of images and are mean
+    subtracted, with every pixel within 0 and 255 once the mean is added
+    back. The network is built under the 'transform' name scope, so its
+    variables have the same names in every graph.
+    Upsampling resizes before a convolution instead of a transposed
+    convolution, which avoids checkerboard artifacts.
+    """
+    rng = np.random.RandomState(seed)
+    variables = []
+
+    def _instance_norm(x, name, channels):
+        """
+        Normalizes every channel of every image on its own.
+        """
+        scale = tf.Variable(np.ones(channels, dtype=np.float32), name=name + '/scale')
+        shift = tf.Variable(np.zeros(channels, dtype=np.float32), name=name + '/shift')
+        variables.extend([scale, shift])
+        mean, variance = tf.nn.moments(x, [1, 2], keep_dims=True)
+        return (x - mean) * tf.rsqrt(variance + 1e-5) * scale + shift
+
+    def _conv(x, name, size, in_channels, out_channels, stride=1, relu=True, norm=True):
+        """
+        Returns the reflection padded convolution of x, instance normalized
+        and rectified.
+        """
+        with tf.name_scope(name):
+            W = _conv_weights(rng, name + '/W', size, in_channels, out_channels)
+            variables.append(W)
+            pad = size // 2
+            x = tf.pad(x, [[0, 0], [pad, pad], [pad, pad], [0, 0]], mode='REFLECT')
+            x = tf.nn.conv2d(x, W, strides=[1, stride, stride, 1], padding='VALID')
+            if norm:
+                x = _instance_norm(x, name, out_channels)
+            else:
+                b = tf.Variable(np.zeros(out_channels, dtype=np.float32), name=name + '/b')
+                variables.append(b)
+                x = x + b
+            return tf.nn.relu(x) if relu else x
+
+    def _upsample(x, like):
+        """
+        Resizes x to the height and width of like, by nearest neighbour.
+        """
+        return tf.image.resize_nearest_neighbor(x, tf.shape(like)[1:3])
+
+    f1, f2, f3 = filters
+    with tf.name_scope('transform'):
+        # Mean subtracted pixels are brought to about -1 to 1.
+        x = images / 127.5
+        down1 = _conv(x, 'down1', 9, 3, f1)
+        down2 = _conv(down1, 'down2', 3, f1, f2, stride=2)
+        x = _conv(down2, 'down3', 3, f2, f3, stride=2)
+        for n in range(residual_blocks):
+            name = 'residual%d' % (n + 1)
+            y = _conv(x, name + '_1', 3, f3, f3)
+            x = x + _conv(y, name + '_2', 3, f3, f3, relu=False)
+        x = _conv(_upsample(x, down2), 'up1', 3, f3, f2)
+        x = _conv(_upsample(x, down1), 'up2', 3, f2, f1)
+        x = _conv(x, 'output', 9, f1, 3, relu=False, norm=False)
+        # The output pixels, mean subtracted, stay within 0 and 255.
+        output = 127.5 * tf.tanh(x) + (127.5 - MEAN_VALUES.astype(np.float32))
+    return output, variables
+
+
+def total_variation_loss(images):
+    """
+    Returns the mean absolute difference of neighbouring pixels of images,
+    summed over the images.
+    """
+    with tf.name_scope('tv_loss'):
+        height, width = images.get_shape().as_list()[1:3]
+        return tf.reduce_sum(tf.image.total_variation(images)) / (height * width * 3)
+
+
+def style_targets(sess, model, style_path, style_image, model_path, style_layers=STYLE_LAYERS,
+                  cache=None):
+    """
+    Returns the gram matrices of style_image, loaded from style_path, from
+    cache, a feature_cache.FeatureCache, when they were computed before by
+    the training of another network or a worker job of the same size.
+    """
+    keys = None
+    if cache is not None:
+        keys = [cache.key(style_path, style_image.shape, layer_name, model_path, 'gram',
+                          RESIZE_POLICY, PREPROCESSING)
+                for layer_name, _ in style_layers]
+        grams = cache.get_many(keys)
+        if grams is not None:
+            return grams
+    _, grams = extract_targets(sess, model, None, style_image, CONTENT_LAYER, style_layers)
+    if cache is not None:
+        for key, gram in zip(keys, grams):
+            cache.put(key, gram)
+    return grams
+
+
+def train_style(model_path, style_path, content_paths, output_path,
+                height=TRAIN_HEIGHT, width=TRAIN_WIDTH, batch_size=BATCH_SIZE,
+                iterations=TRAIN_ITERATIONS, learning_rate=TRAIN_LEARNING_RATE,
+                alpha=ALPHA, beta=BETA, tv_weight=TV_WEIGHT,
+                content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS,
+                filters=FILTERS, residual_blocks=RESIDUAL_BLOCKS,
+                report_every=REPORT_EVERY, checkpoint_every=CHECKPOINT_EVERY,
+                observers=(), use_cache=True, seed=0, config=None):
+    """
+    Trains a transform_net to paint the style of the image at style_path and
+    saves it to output_path, see FastStylizer. Returns the info of the
+    training: the number of steps, the final loss and the seconds spent.
+    content_paths is a folder of photos or a list of their paths; every
+    step paints batch_size of them, brought to height x width, in an order
+    shuffled every epoch. The loss is the total of loss_terms_func, the
+    content and style losses of the paper computed by the vgg model at
+    model_path, plus tv_weight times the total variation, averaged over
+    the batch. The gram matrices of the style are computed once, or read
+    from the feature cache, and the preprocessed photos are cached by the
+    ingest.
+    output_path is a checkpoint written every checkpoint_every steps and at
+    the end, holding the network and the optimizer state. If it exists,
+    training goes on from it, up to iterations steps in all. observers are
+    notified every report_every steps with the first painted photo of the
+    batch.
+    """
+    if isinstance(content_paths, str):
+        content_paths = list_images(content_paths)
+    if len(content_paths) < batch_size:
+        raise ValueError('Training needs at least %d photos, got %d' % (
+            batch_size, len(content_paths)))
+    settings = {
+        'filters': list(filters),
+        'residual_blocks': residual_blocks,
+        'style': style_path,
+        'height': height,
+        'width': width,
+    }
+    ingest = Ingest(height, width, TRAIN_POLICY, use_cache=use_cache)
+    cache = FeatureCache(CACHE_DIR, CACHE_MAX_BYTES) if use_cache else None
+    batches_per_epoch = len(content_paths) // batch_size
+
+    def _batch_futures(step):
+        """
+        Starts loading the photos of a step.
+        """
+        epoch, n = divmod(step, batches_per_epoch)
+        order = np.random.RandomState(seed + epoch).permutation(len(content_paths))
+        return [ingest.submit(content_paths[i]) for i in order[n * batch_size:(n + 1) * batch_size]]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        content_images = tf.placeholder('float32', (batch_size, height, width, 3))
+        stylized, net_variables = transform_net(content_images, filters, residual_blocks, seed)
+        model = load_vgg_model(model_path, model_layers(content_layer, style_layers),
+                               height=height, width=width, input_tensor=stylized)
+        sess = tf.Session(config=config)
+        style_image = ingest.load(style_path, height, width, RESIZE_POLICY)
+        grams = style_targets(sess, model, style_path, style_image, model_path, style_layers, cache)
+        # The content targets come from the extraction tower fed the same
+        # photos, in the same run.
+        content_features = tf.stop_gradient(model['extract'][content_layer])
+        loss_terms = loss_terms_func(sess, model, content_features, grams, alpha, beta,
+                                     content_layer, style_layers)
+        loss_terms['tv'] = total_variation_loss(stylized)
+        loss_terms['total'] = (loss_terms['total'] + tv_weight * loss_terms['tv']) / batch_size
+        optimizer = tf.train.AdamOptimizer(learning_rate)
+        train_step = optimizer.minimize(loss_terms['total'], var_list=net_variables)
+        state_variables = net_variables + optimizer.variables()
+        state_values = [tf.placeholder(variable.dtype.base_dtype, variable.get_shape())
+                        for variable in state_variables]
+        load_state = tf.group(*[variable.assign(value)
+                                for variable, value in zip(state_variables, state_values)])
+        sess.run(tf.variables_initializer(state_variables))
+        graph.finalize()
+
+        names = [variable.op.name for variable in state_variables]
+        start = time.time()
+        first = 0
+        history = []
+        if os.path.exists(output_path):
+            state = load_checkpoint(output_path)
+            if state['names'] != names or state['info'].get('settings') != settings:
+                raise ValueError('Checkpoint %s was trained with other settings' % output_path)
+            sess.run(load_state, feed_dict=dict(zip(state_values, state['values'])))
+            first = state['step']
+            history = state['history']
+            start -= state['info'].get('seconds', 0.0)
+
+        def _save(step):
+            info = {'settings': settings, 'net_variables': len(net_variables),
+                    'seconds': time.time() - start}
+            save_checkpoint(output_path, names, sess.run(state_variables), step, history, info)
+
+        metrics = None
+        try:
+            futures = _batch_futures(first)
+            for step in range(first, iterations):
+                feed_dict = {}
+                feed_dict[content_images] = np.concatenate([f.result() for f in futures], axis=0)
+                feed_dict[model['extract_input']] = feed_dict[content_images]
+                # The photos of the next step load while this one runs.
+                if step + 1 < iterations:
+                    futures = _batch_futures(step + 1)
+                if step % report_every == 0 or step == iterations - 1:
+                    _, metrics, images = sess.run([train_step, loss_terms, stylized],
+                                                  feed_dict=feed_dict)
+                    history.append((step, float(metrics['total'])))
+                    for observer in observers:
+                        observer.on_progress(step, images[:1], metrics)
+                else:
+                    sess.run(train_step, feed_dict=feed_dict)
+                if (step + 1) % checkpoint_every == 0 and step < iterations - 1:
+                    _save(step + 1)
+            _save(max(iterations, first))
+        finally:
+            ingest.close()
+            sess.close()
+    return {
+        'iterations': max(iterations, first),
+        'loss': None if metrics is None else float(metrics['total']),
+        'seconds': time.time() - start,
+    }
+
+
+class FastStylizer(object):
+    """
+    Paints images with a network trained by train_style, in one forward
+    pass each, at any size. Images are mean subtracted batches, as returned
+    by load_image, and so are the painted images.
+    """
+
+    def __init__(self, network_path, config=None):
+        state = load_checkpoint(network_path)
+        settings = state['info']['settings']
+        count = state['info']['net_variables']
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.images = tf.placeholder('float32', (None, None, None, 3))
+            self.stylized, variables = transform_net(self.images, settings['filters'],
+                                                     settings['residual_blocks'])
+            if [variable.op.name for variable in variables] != state['names'][:count]:
+                raise ValueError('%s does not hold a network of this version' % network_path)
+            self.sess = tf.Session(config=config)
+            values = [tf.placeholder(variable.dtype.base_dtype, variable.get_shape())
+                      for variable in variables]
+            self.sess.run(tf.group(*[variable.assign(value)
+                                     for variable, value in zip(variables, values)]),
+                          feed_dict=dict(zip(values, state['values'][:count])))
+            self.graph.finalize()
+
+    def stylize(self, image):
+        """
+        Returns image painted in the style of the network.
+        """
+        return self.sess.run(self.stylized, feed_dict={self.images: image})
+
+    def close(self):
+        self.sess.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train or use a fast style network.')
+    commands = parser.add_subparsers(dest='command')
+    train = commands.add_parser('train', help='train a network for a style')
+    train.add_argument('style', help='style image')
+    train.add_argument('photos', help='folder of training photos')
+    train.add_argument('network', help='.npz file of the network, resumed if it exists')
+    train.add_argument('--model', default='imagenet-vgg-verydeep-19/',
+                       help='vgg weight store folder or .pkl file')
+    train.add_argument('--size', type=int, default=TRAIN_HEIGHT, help='size of the training photos')
+    train.add_argument('--iterations', type=int, default=TRAIN_ITERATIONS)
+    train.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    train.add_argument('--filters', type=int, nargs=3, default=FILTERS)
+    train.add_argument('--residual-blocks', type=int, default=RESIDUAL_BLOCKS)
+    paint = commands.add_parser('stylize', help='paint an image with a trained network')
+    paint.add_argument('network', help='.npz file of the network')
+    paint.add_argument('content', help='image to paint')
+    paint.add_argument('output', help='painted image')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        info = train_style(args.model, args.style, args.photos, args.network, args.size, args.size,
+                           args.batch_size, args.iterations, filters=args.filters,
+                           residual_blocks=args.residual_blocks, observers=[PrintObserver()])
+        print('%d steps, loss %s, %.1fs' % (info['iterations'], info['loss'], info['seconds']))
+    elif args.command == 'stylize':
+        stylizer = FastStylizer(args.network)
+        start = time.time()
+        image = stylizer.stylize(load_image(args.content))
+        print('Painted in %.2fs' % (time.time() - start))
+        save_image(args.output, image)
+        stylizer.close()
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,142 @@
+# This script keeps style gram matrices and content features on disk
+# so that jobs reusing a style image can skip its forward passes
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+
+# Default folder and size budget of the cache.
+CACHE_DIR = 'cache/'
+CACHE_MAX_BYTES = 2 * 1024**3
+
+# Digests already computed by this process, keyed by (path, size, mtime).
+_file_digests = {}
+
+
+def file_digest(path):
+    """
+    Return the sha1 hex digest of a file's content.
+    The vgg weight file is large, so digests are remembered for as long as
+    the file's size and modification time do not change. For a weight store
+    folder the digest of its index.json is used, which records the digest
+    of every layer.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.json')
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _file_digests:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        _file_digests[memo_key] = sha.hexdigest()
+    return _file_digests[memo_key]
+
+
+class FeatureCache(object):
+    """
+    Content addressed disk cache of target features.
+    Each entry is one .npy file named after the hash of the image content,
+    the image size, how the image was brought to that size, the layer
+    name, the weight file and the kind of target ('gram' for style layers,
+    'features' for content layers). Entries are
+    evicted, least recently used first, once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, image_path, image_shape, layer_name, weights_path, kind,
+            resize_policy, preprocessing):
+        """
+        Return the cache key of a target computed from an image file,
+        brought to image_shape with resize_policy by the loader tagged
+        preprocessing, e.g. vgg_model.PREPROCESSING or
+        ingest.PREPROCESSING, as different loaders give different pixels.
+        """
+        parts = [
+            kind,
+            file_digest(image_path),
+            'x'.join(str(d) for d in image_shape),
+            resize_policy,
+            preprocessing,
+            layer_name,
+            file_digest(weights_path),
+        ]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        """
+        Return the cached array for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            value = np.load(path)
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used for eviction. Another process may
+        # have evicted it since it was loaded, the value is still good.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """
+        Store an array under key and evict old entries if over budget.
+        """
+        path = self._path(key)
+        # Write to a temporary file first so readers never see partial data.
+        # Every writer, thread or process, gets its own temporary file.
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(value))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get_many(self, keys):
+        """
+        Return the cached arrays for all keys, or None if any one is missing.
+        """
+        values = [self.get(key) for key in keys]
+        if any(value is None for value in values):
+            return None
+        return values
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by another process sharing the cache.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
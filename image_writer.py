@@ -0,0 +1,128 @@
+# This script writes painted images from background threads, so that
+# adding the mean back, encoding and disk I/O never stall the optimizer
+import os
+import threading
+import queue
+from PIL import Image
+
+from vgg_model import deprocess_image
+
+
+# Number of images waiting to be written before submit blocks or drops.
+MAX_PENDING = 8
+# Number of writer threads.
+WORKERS = 2
+# Options passed to PIL when saving, by format.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 95},
+    'PNG': {'compress_level': 6},
+}
+
+
+class ImageWriter(object):
+    """
+    Bounded queue of images written by a pool of threads.
+    submit takes the raw, mean subtracted image as returned by the model
+    and returns at once; the image must not be modified afterwards. When
+    max_pending images are waiting, the 'block' policy makes submit wait
+    for a free slot while the 'drop' policy drops the image and counts it
+    in dropped.
+    image_format forces the format of every file ('PNG', 'JPEG', ...),
+    otherwise it follows each path's extension. Errors raised while
+    writing are raised again by flush.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING, workers=WORKERS, policy='block',
+                 image_format=None, save_options=SAVE_OPTIONS):
+        if policy not in ('block', 'drop'):
+            raise ValueError('Unknown policy %s' % policy)
+        self.policy = policy
+        self.image_format = image_format
+        self.save_options = save_options
+        self.dropped = 0
+        self.written = 0
+        self._errors = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_pending)
+        self._threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, path, image, block=None):
+        """
+        Queues image to be written at path. Returns False if it was dropped.
+        block overrides the writer's policy for this image, e.g. so that a
+        final image is never dropped.
+        """
+        if block is None:
+            block = self.policy == 'block'
+        try:
+            self._queue.put((path, image), block)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _work(self):
+        """
+        Writes queued images until the None sentinel is received.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+                with self._lock:
+                    self.written += 1
+            except Exception as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, image):
+        """
+        Adds the mean back, encodes and writes one image.
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another writer thread created it first.
+                if not os.path.isdir(directory):
+                    raise
+        image_format = self.image_format
+        if image_format is None:
+            image_format = Image.registered_extensions().get(
+                os.path.splitext(path)[1].lower(), 'PNG')
+        options = self.save_options.get(image_format, {})
+        Image.fromarray(deprocess_image(image)).save(path, image_format, **options)
+
+    def flush(self):
+        """
+        Waits until every queued image is written.
+        """
+        self._queue.join()
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """
+        Flushes and stops the writer threads.
+        """
+        try:
+            self.flush()
+        finally:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
@@ -0,0 +1,142 @@
+# This script loads images for the model: decoding, resizing and mean
+# subtraction run on a pool of threads ahead of use, and the results are
+# cached on disk so an image is only decoded once per size
+import os
+import hashlib
+import collections
+import concurrent.futures
+import numpy as np
+from PIL import Image
+
+from vgg_model import fitted_size, place_image, MEAN_VALUES, RESIZE_POLICY
+from feature_cache import FeatureCache, file_digest
+
+
+# Folder and size budget of the cache of preprocessed images.
+INGEST_CACHE_DIR = 'cache/images/'
+INGEST_CACHE_MAX_BYTES = 1024**3
+# Number of decoding threads, and of images loaded ahead by stream.
+INGEST_WORKERS = 4
+PREFETCH = 8
+# Extensions of the image files read from a folder.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+# Bumped whenever preprocessing changes, so older cache entries are not used.
+INGEST_VERSION = 1
+# Tag of the preprocessing of the ingest in feature cache keys, see
+# vgg_model.PREPROCESSING.
+PREPROCESSING = 'ingest/%d' % INGEST_VERSION
+
+
+def list_images(image_dir):
+    """
+    Returns the paths of the images in image_dir, sorted by name.
+    """
+    names = [name for name in os.listdir(image_dir)
+             if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+    return [os.path.join(image_dir, name) for name in sorted(names)]
+
+
+def preprocess_image(path, height=None, width=None, policy=RESIZE_POLICY):
+    """
+    Returns the image at path as a float32 mean subtracted batch of one,
+    like vgg_model.load_image, but resized by PIL on the decoded 8 bit
+    pixels, which is much cheaper than resizing the float image.
+    """
+    with Image.open(path) as picture:
+        picture = picture.convert('RGB')
+        if height is not None and width is not None:
+            new_height, new_width = fitted_size(picture.height, picture.width,
+                                                height, width, policy)
+            if (new_height, new_width) != (picture.height, picture.width):
+                picture = picture.resize((new_width, new_height), Image.BILINEAR)
+        image = np.asarray(picture, dtype=np.float32)
+    image = image[np.newaxis] - MEAN_VALUES.astype(np.float32)
+    if height is not None and width is not None:
+        image = place_image(image, height, width, policy)
+    return image
+
+
+class Ingest(object):
+    """
+    Loads images on a pool of threads, see preprocess_image, and caches the
+    preprocessed images on disk keyed by the content of the file, the size
+    and the policy, so a changed file is never served from the cache.
+    PIL and numpy release the GIL while decoding and converting, so the
+    threads load images while the model runs.
+    """
+
+    def __init__(self, height=None, width=None, policy=RESIZE_POLICY, workers=INGEST_WORKERS,
+                 use_cache=True, cache_dir=INGEST_CACHE_DIR, cache_max_bytes=INGEST_CACHE_MAX_BYTES):
+        self.height = height
+        self.width = width
+        self.policy = policy
+        self.cache = FeatureCache(cache_dir, cache_max_bytes) if use_cache else None
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def key(self, path, height, width, policy):
+        """
+        Returns the cache key of an image at a size.
+        """
+        parts = [
+            'ingest',
+            str(INGEST_VERSION),
+            file_digest(path),
+            '%sx%s' % (height, width),
+            policy,
+        ]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _load(self, path, height, width, policy):
+        """
+        Returns the preprocessed image, from the cache if possible.
+        """
+        if self.cache is None:
+            return preprocess_image(path, height, width, policy)
+        key = self.key(path, height, width, policy)
+        image = self.cache.get(key)
+        if image is None:
+            image = preprocess_image(path, height, width, policy)
+            self.cache.put(key, image)
+        return image
+
+    def submit(self, path, height=None, width=None, policy=None):
+        """
+        Starts loading the image at path and returns a future of it. The
+        size and policy default to the ingest's.
+        """
+        if height is None and width is None:
+            height, width = self.height, self.width
+        if policy is None:
+            policy = self.policy
+        return self._pool.submit(self._load, path, height, width, policy)
+
+    def load(self, path, height=None, width=None, policy=None):
+        """
+        Returns the image at path, see submit.
+        """
+        return self.submit(path, height, width, policy).result()
+
+    def stream(self, inputs, prefetch=PREFETCH):
+        """
+        Yields (path, image) for every image of inputs, in order, keeping up
+        to prefetch images loading ahead. inputs is a folder, see
+        list_images, or any iterable of paths, e.g. a generator of files
+        as they arrive. Errors are raised when their image is reached.
+        """
+        if isinstance(inputs, str):
+            inputs = list_images(inputs)
+        pending = collections.deque()
+        for path in inputs:
+            pending.append((path, self.submit(path)))
+            if len(pending) > prefetch:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+    def close(self):
+        """
+        Stops the threads once the images submitted are loaded.
+        """
+        self._pool.shutdown()
@@ -0,0 +1,127 @@
+# This script keeps the models built for several image sizes in one warm
+# session, so images of any size are painted without reloading the weights
+import collections
+import tensorflow as tf
+
+from vgg_model import load_vgg_model, load_vgg_weights, VGG_LAYERS, RECOMPUTE_GRADIENTS
+
+
+# Number of models kept by default.
+MODEL_CACHE_SIZE = 4
+# Number of objects built for a model, such as losses and painters, kept by
+# default, see ModelCache.built.
+BUILDS_PER_MODEL = 4
+
+
+class ModelCache(object):
+    """
+    Least recently used cache of models keyed by image size, deepest layer
+    needed and batch size. Models recomputing their gradient, see
+    vgg_model.RECOMPUTE_GRADIENTS, only hold the layers they were built
+    for, so with recompute they are keyed by every layer needed instead.
+    The weights are loaded once. Every model is built in the cache's graph,
+    shares its weight constants with the other models and runs in the
+    cache's session, so a new size only costs building its tower. Ops can
+    not be removed from a TensorFlow graph, so once as many models have been
+    evicted as the cache holds, the graph and session are started afresh on
+    the next miss; models returned before that must not be used anymore.
+    Build losses and painters for a model with built, so they are reused
+    and dropped along with their model.
+    """
+
+    def __init__(self, path, capacity=MODEL_CACHE_SIZE, config=None,
+                 builds_per_model=BUILDS_PER_MODEL, recompute=RECOMPUTE_GRADIENTS):
+        self.weights = load_vgg_weights(path)
+        self.recompute = recompute
+        self.capacity = capacity
+        self.builds_per_model = builds_per_model
+        self.config = config
+        self.hits = 0
+        self.misses = 0
+        self.graph = None
+        self.sess = None
+        self._entries = collections.OrderedDict()
+        self._builds = {}
+        self._reset()
+
+    def _reset(self):
+        """
+        Starts a new graph and session holding no model.
+        """
+        if self.sess is not None:
+            self.sess.close()
+        self.graph = tf.Graph()
+        self.sess = tf.Session(graph=self.graph, config=self.config)
+        self._constants = {}
+        self._entries.clear()
+        self._builds.clear()
+        self._evicted = 0
+
+    def key(self, height, width, layers, batch_size=1):
+        """
+        Returns the cache key of a model. Layer sets that stop at the same
+        depth build the same model and share the key, unless the models
+        recompute their gradient.
+        """
+        layer_names = [layer_name for layer_name, _ in VGG_LAYERS]
+        if self.recompute:
+            return (height, width, tuple(layer_name for layer_name in layer_names
+                                         if layer_name in layers), batch_size)
+        depth = max(layer_names.index(layer_name) for layer_name in layers)
+        return (height, width, layer_names[depth], batch_size)
+
+    def get(self, height, width, layers, batch_size=1):
+        """
+        Returns the model for images of height x width holding batch_size
+        images, built up to the deepest of layers, and holding all of them.
+        """
+        key = self.key(height, width, layers, batch_size)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        if self._evicted >= self.capacity:
+            self._reset()
+        while len(self._entries) >= self.capacity:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._evicted += 1 + len(self._builds.pop(evicted_key, ()))
+        with self.graph.as_default():
+            model = load_vgg_model(self.weights, list(layers), batch_size, height, width,
+                                   constants=self._constants, recompute=self.recompute)
+            self.sess.run(model['input'].initializer)
+        self._entries[key] = model
+        return model
+
+    def built(self, model_key, key, build):
+        """
+        Returns what build() returns, e.g. the targets, loss and painter of
+        a model for some settings, calling it under the cache's graph only
+        the first time key is asked for with the model of model_key, see
+        key. Ops can not be removed from a graph, so at most
+        builds_per_model objects are kept per model, least recently used
+        first, and dropped objects count like evicted models towards
+        starting the graph afresh.
+        """
+        builds = self._builds.setdefault(model_key, collections.OrderedDict())
+        if key in builds:
+            builds.move_to_end(key)
+            return builds[key]
+        while len(builds) >= self.builds_per_model:
+            builds.popitem(last=False)
+            self._evicted += 1
+        with self.graph.as_default():
+            value = build()
+        builds[key] = value
+        return value
+
+    def close(self):
+        """
+        Closes the session and drops every model.
+        """
+        self._entries.clear()
+        self._builds.clear()
+        if self.sess is not None:
+            self.sess.close()
+            self.sess = None
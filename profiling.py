@@ -0,0 +1,134 @@
+# This script profiles sampled iterations of the optimization loop: where
+# the time and memory of every step go, per VGG layer and per loss term
+import os
+import re
+import json
+import collections
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+# Profile every PROFILE_EVERY iterations after skipping the first
+# PROFILE_SKIP ones, which include one off setup costs, and stop after
+# PROFILE_SAMPLES profiled iterations.
+PROFILE_EVERY = 10
+PROFILE_SKIP = 5
+PROFILE_SAMPLES = 10
+# Name scopes ops are grouped by. Scopes made unique by TensorFlow with a
+# _<n> suffix, e.g. the layers of a second model in the same graph, are
+# grouped under their base name.
+_SCOPE = re.compile(r'^(conv\d_\d|avgpool\d|extract|content_loss|style_loss|gram|Adam)(_\d+)?$')
+
+
+def op_group(node_name):
+    """
+    Returns the group of an op from its name: the name scopes it was built
+    in, e.g. 'conv4_2', 'style_loss/conv1_1/gram' or 'Adam', prefixed with
+    'backward/' for the ops computing gradients. Other scopes, such as the
+    gradients scope or the prefixes added by graph rewrites, are skipped.
+    Ops built outside of these scopes are grouped under 'other'.
+    """
+    parts = node_name.split(':')[0].split('/')[:-1]
+    backward = any(part.startswith('gradients') for part in parts)
+    scopes = []
+    for part in parts:
+        match = _SCOPE.match(part)
+        if match:
+            scopes.append(match.group(1))
+        elif scopes:
+            break
+    group = '/'.join(scopes) if scopes else 'other'
+    return 'backward/' + group if backward else group
+
+
+class Profiler(object):
+    """
+    Collects the run metadata of sampled iterations and aggregates the time
+    and memory of every op group. Pass it to a painter's run; wants tells
+    the painter which iterations to trace.
+    With trace_dir, a Chrome trace of every sampled iteration is written
+    there as step_<iteration>.json, to open in chrome://tracing.
+    """
+
+    def __init__(self, every=PROFILE_EVERY, skip=PROFILE_SKIP, samples=PROFILE_SAMPLES,
+                 trace_dir=None):
+        self.every = every
+        self.skip = skip
+        self.samples = samples
+        self.trace_dir = trace_dir
+        self.run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        self.iterations = []
+        # Group name to [op runs, microseconds, bytes allocated].
+        self.groups = collections.defaultdict(lambda: [0, 0, 0])
+        # Allocator name to its peak bytes over the sampled iterations.
+        self.peak_bytes = {}
+        if trace_dir is not None and not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+
+    def wants(self, iteration):
+        """
+        Returns True if iteration should be traced.
+        """
+        return (iteration >= self.skip and (iteration - self.skip) % self.every == 0
+                and len(self.iterations) < self.samples)
+
+    def add(self, iteration, run_metadata):
+        """
+        Adds the run metadata of a traced iteration.
+        """
+        self.iterations.append(iteration)
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                group = self.groups[op_group(node.node_name)]
+                group[0] += 1
+                group[1] += node.all_end_rel_micros
+                for output in node.output:
+                    group[2] += output.tensor_description.allocation_description.requested_bytes
+                for memory in node.memory:
+                    self.peak_bytes[memory.allocator_name] = max(
+                        self.peak_bytes.get(memory.allocator_name, 0), memory.peak_bytes)
+        if self.trace_dir is not None:
+            trace = timeline.Timeline(run_metadata.step_stats)
+            path = os.path.join(self.trace_dir, 'step_%05d.json' % iteration)
+            with open(path, 'w') as f:
+                f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+    def summary(self):
+        """
+        Returns a list of (group, milliseconds per step, share of the step
+        time, megabytes allocated per step), slowest group first.
+        """
+        steps = max(len(self.iterations), 1)
+        total = float(sum(group[1] for group in self.groups.values())) or 1.0
+        rows = []
+        for name, (_, micros, allocated) in self.groups.items():
+            rows.append((name, micros / 1000.0 / steps, micros / total,
+                         allocated / 2.0 ** 20 / steps))
+        rows.sort(key=lambda row: -row[1])
+        return rows
+
+    def format_summary(self):
+        """
+        Returns the summary as a table.
+        """
+        lines = ['%-32s %10s %7s %10s' % ('group', 'ms/step', 'share', 'MB/step')]
+        for name, millis, share, megabytes in self.summary():
+            lines.append('%-32s %10.2f %6.1f%% %10.1f' % (name, millis, 100 * share, megabytes))
+        for allocator, peak in sorted(self.peak_bytes.items()):
+            lines.append('peak memory of %s: %.1f MB' % (allocator, peak / 2.0 ** 20))
+        lines.append('%d iterations profiled' % len(self.iterations))
+        return '\n'.join(lines)
+
+    def write_summary(self, path):
+        """
+        Writes the summary and peak memory to a .json file.
+        """
+        summary = {
+            'iterations': self.iterations,
+            'groups': [{'group': name, 'ms_per_step': millis, 'share': share,
+                        'mb_per_step': megabytes}
+                       for name, millis, share, megabytes in self.summary()],
+            'peak_bytes': self.peak_bytes,
+        }
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
@@ -0,0 +1,87 @@
+# This script holds the observers notified while a picture is painted,
+# they replace the print statements of the optimization loop
+import os
+
+from vgg_model import save_image
+
+
+class Observer(object):
+    """
+    Base class of the objects notified while a picture is painted.
+    metrics is a dict from loss term name ('total', 'content', 'style' and
+    'style/<layer>') to its value. Subclasses override what they need.
+    """
+
+    def on_start(self, initial_image):
+        pass
+
+    def on_progress(self, iteration, image, metrics):
+        pass
+
+    def on_finish(self, image, metrics):
+        pass
+
+
+class PrintObserver(Observer):
+    """
+    Prints the loss terms at every report.
+    """
+
+    def on_progress(self, iteration, image, metrics):
+        print('Iteration %d' % (iteration))
+        for name in sorted(metrics):
+            print('%-14s: %g' % (name, metrics[name]))
+
+
+class SaveImageObserver(Observer):
+    """
+    Saves the painted image at every report as <iteration>.<extension> in
+    output_dir, and the final image as final_name.
+    With an image_writer.ImageWriter the images are written in the
+    background; the final image is never dropped and is flushed before
+    on_finish returns.
+    """
+
+    def __init__(self, output_dir='output/', final_name='art.jpg', writer=None,
+                 extension='png'):
+        self.output_dir = output_dir
+        self.final_name = final_name
+        self.writer = writer
+        self.extension = extension
+
+    def _save(self, name, image, final=False):
+        path = os.path.join(self.output_dir, name)
+        if self.writer is not None:
+            self.writer.submit(path, image, block=True if final else None)
+            if final:
+                self.writer.flush()
+            return
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        save_image(path, image)
+
+    def on_progress(self, iteration, image, metrics):
+        self._save('%d.%s' % (iteration, self.extension), image)
+
+    def on_finish(self, image, metrics):
+        if self.final_name is not None:
+            self._save(self.final_name, image, final=True)
+        elif self.writer is not None:
+            self.writer.flush()
+
+
+class HistoryObserver(Observer):
+    """
+    Records the loss terms of every report as (iteration, metrics) pairs,
+    and the loss terms of the painted image in final.
+    """
+
+    def __init__(self):
+        self.history = []
+        self.final = None
+
+    def on_progress(self, iteration, image, metrics):
+        self.history.append((iteration, dict(metrics)))
+
+    def on_finish(self, image, metrics):
+        self.final = dict(metrics)
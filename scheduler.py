@@ -0,0 +1,179 @@
+# This script paints many jobs side by side in several processes, each
+# with its own share of the CPU cores, instead of giving every core to the
+# ops of a single job
+#
+# usage: python scheduler.py jobs.json [--workers 4] [--pin]
+#                            [--model imagenet-vgg-verydeep-19/]
+#
+# jobs.json holds a list of jobs as described in worker.py.
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import traceback
+import multiprocessing
+import tensorflow as tf
+
+from worker import StylizeWorker, VGG_MODEL
+
+
+# Number of worker processes.
+WORKERS = 4
+# Threads running independent ops of a worker at once. The cores of a
+# worker go to the threads running each op, see partition_cores.
+INTER_OP_THREADS = 1
+# Pin every worker to its own cores, where the platform allows it.
+PIN_CPUS = False
+
+
+def available_cores():
+    """
+    Returns the ids of the CPU cores this process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def partition_cores(workers, cores=None):
+    """
+    Splits cores, by default every available core, into workers contiguous
+    sets as even as possible, so that neighbouring cores, which often share
+    caches, go to the same worker.
+    """
+    if cores is None:
+        cores = available_cores()
+    workers = max(min(workers, len(cores)), 1)
+    size, extra = divmod(len(cores), workers)
+    sets = []
+    first = 0
+    for n in range(workers):
+        last = first + size + (1 if n < extra else 0)
+        sets.append(cores[first:last])
+        first = last
+    return sets
+
+
+def _work(index, model_path, cores, inter_op_threads, pin, use_feature_cache,
+          jobs, records):
+    """
+    Runs the jobs of the jobs queue in a worker process until the None
+    sentinel, putting the record of every job in the records queue.
+    """
+    if pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    config = tf.ConfigProto(intra_op_parallelism_threads=len(cores),
+                            inter_op_parallelism_threads=inter_op_threads)
+    worker = StylizeWorker(model_path, None, use_feature_cache, config=config)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            start = time.time()
+            try:
+                record = worker.run_job(job)
+            except Exception:
+                record = {'job': job, 'status': 'failed', 'error': traceback.format_exc()}
+            record['worker'] = index
+            record['cores'] = cores
+            record['seconds'] = time.time() - start
+            records.put(record)
+    finally:
+        worker.close()
+
+
+def run_jobs(jobs, model_path=VGG_MODEL, workers=WORKERS, inter_op_threads=INTER_OP_THREADS,
+             pin=PIN_CPUS, use_feature_cache=True, cores=None):
+    """
+    Paints jobs with workers processes and returns the record of every job,
+    in order of completion, and the throughput report, see throughput.
+    Every worker gets its share of cores for the threads running each op,
+    is pinned to them with pin, and takes the next job as soon as it is
+    done with one. Workers memory map the same weight store, so its pages
+    are read from disk once and shared in the page cache, but every worker
+    copies the weights into the constants of its own model: resident
+    memory grows by the whole model for every worker. A .pkl is also read
+    by every worker.
+    """
+    core_sets = partition_cores(workers, cores)
+    context = multiprocessing.get_context('spawn')
+    job_queue = context.Queue()
+    record_queue = context.Queue()
+    for job in jobs:
+        job_queue.put(job)
+    for _ in core_sets:
+        job_queue.put(None)
+
+    start = time.time()
+    processes = []
+    for index, worker_cores in enumerate(core_sets):
+        process = context.Process(target=_work, args=(
+            index, model_path, worker_cores, inter_op_threads, pin, use_feature_cache,
+            job_queue, record_queue))
+        process.start()
+        processes.append(process)
+    records = []
+    try:
+        while len(records) < len(jobs):
+            # A worker that died takes its job with it.
+            if not any(process.is_alive() for process in processes) and record_queue.empty():
+                break
+            try:
+                records.append(record_queue.get(timeout=1.0))
+            except queue.Empty:
+                continue
+    finally:
+        for process in processes:
+            process.join()
+    wall = time.time() - start
+    return records, throughput(records, wall, core_sets)
+
+
+def throughput(records, wall, core_sets):
+    """
+    Returns the aggregate throughput of a run taking wall seconds: the jobs
+    done per hour and per core hour, the mean seconds of a job, and the
+    share of the time every worker was busy.
+    """
+    done = [record for record in records if record['status'] == 'done']
+    busy = [0.0] * len(core_sets)
+    for record in records:
+        busy[record['worker']] += record['seconds']
+    cores = sum(len(worker_cores) for worker_cores in core_sets)
+    return {
+        'workers': len(core_sets),
+        'cores': cores,
+        'jobs': len(records),
+        'failed': len(records) - len(done),
+        'seconds': wall,
+        'jobs_per_hour': 3600.0 * len(done) / wall if wall > 0 else 0.0,
+        'jobs_per_core_hour': 3600.0 * len(done) / (wall * cores) if wall > 0 else 0.0,
+        'mean_job_seconds': sum(record['seconds'] for record in done) / len(done) if done else 0.0,
+        'worker_busy': [seconds / wall if wall > 0 else 0.0 for seconds in busy],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Paint jobs in several processes.')
+    parser.add_argument('jobs', help='.json file holding a list of jobs')
+    parser.add_argument('--model', default=VGG_MODEL, help='vgg weight store folder or .pkl file')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--inter-op-threads', type=int, default=INTER_OP_THREADS)
+    parser.add_argument('--pin', action='store_true', help='pin every worker to its cores')
+    parser.add_argument('--records', help='.json file to write the job records to')
+    args = parser.parse_args()
+
+    with open(args.jobs) as f:
+        jobs = json.load(f)
+    records, report = run_jobs(jobs, args.model, args.workers, args.inter_op_threads, args.pin)
+    if args.records:
+        with open(args.records, 'w') as f:
+            json.dump({'records': records, 'throughput': report}, f, indent=1, sort_keys=True)
+    print('%d jobs, %d failed, in %.1fs with %d workers on %d cores: %.1f jobs/hour' % (
+        report['jobs'], report['failed'], report['seconds'], report['workers'],
+        report['cores'], report['jobs_per_hour']))
+    if report['failed']:
+        sys.exit(1)
@@ -0,0 +1,564 @@
+# This script runs the optimization that paints the pictures, so that
+# other scripts can paint without going through the main.py notebook
+import time
+import numpy as np
+import scipy.optimize
+import tensorflow as tf
+
+from vgg_model import load_vgg_model, model_layers, extract_targets, extract_batch_targets
+from vgg_model import load_vgg_weights, extract_style_grams
+from vgg_model import content_loss_func, style_loss_func, generate_noise_image, resize_image
+from vgg_model import CONTENT_LAYER, STYLE_LAYERS, NOISE_RATIO, MEAN_VALUES
+from checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_EVERY
+
+
+###############################################################################
+# Algorithm constants
+###############################################################################
+# Constant to put more emphasis on content loss.
+BETA = 5
+# Constant to put more emphasis on style loss.
+ALPHA = 100
+# Learning rate of the Adam optimizer.
+LEARNING_RATE = 2.0
+# Number of iterations to run.
+ITERATIONS = 400
+# Observers are notified every REPORT_EVERY iterations.
+REPORT_EVERY = 100
+# When Adam may stop early, the loss is checked every CHECK_EVERY iterations.
+CHECK_EVERY = 10
+# Stopping rules of the L-BFGS optimizer. It stops once the relative change
+# of the loss between two iterations falls below LBFGS_FTOL, after
+# LBFGS_MAX_ITERATIONS iterations, or once TIME_BUDGET seconds have passed
+# (None for no limit).
+LBFGS_MAX_ITERATIONS = 1000
+LBFGS_FTOL = 1e-5
+TIME_BUDGET = None
+# Scales of the levels of the coarse to fine pyramid, and the number of
+# iterations run at each of them.
+PYRAMID_SCALES = [0.25, 0.5, 1.0]
+PYRAMID_ITERATIONS = [300, 150, 50]
+
+
+class Targets(object):
+    """
+    Content and style targets held in variables, so that a single loss
+    graph serves any number of images: load new targets and paint again
+    instead of building a new loss with the targets as constants.
+    The content target holds one feature map per image of the model. With
+    per_image_grams every image has its own gram matrices, otherwise one
+    set of gram matrices is shared by all images.
+    """
+
+    def __init__(self, model, content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS,
+                 per_image_grams=False):
+        content_shape = model[content_layer].get_shape().as_list()
+        batch_size = content_shape[0]
+        self.content = tf.Variable(tf.zeros(content_shape), trainable=False)
+        self.grams = []
+        for layer_name, _ in style_layers:
+            N = model[layer_name].get_shape().as_list()[3]
+            shape = (batch_size, N, N) if per_image_grams else (N, N)
+            self.grams.append(tf.Variable(tf.zeros(shape), trainable=False))
+        targets = [self.content] + self.grams
+        self._values = [tf.placeholder('float32', target.get_shape()) for target in targets]
+        self._load = tf.group(*[target.assign(value)
+                                for target, value in zip(targets, self._values)])
+
+    def load(self, sess, content_features, grams):
+        """
+        Loads the content features and gram matrices into the variables.
+        """
+        values = [content_features] + list(grams)
+        sess.run(self._load, feed_dict=dict(zip(self._values, values)))
+
+
+class LossWeights(object):
+    """
+    alpha, beta and the weights of the style layers held in variables, so
+    that a single loss graph serves any weights: load new weights and
+    paint again instead of building a new loss with the weights as
+    constants. Give alpha, beta and style_layers, which pairs every layer
+    of layer_names with its weight variable, to loss_terms_func.
+    """
+
+    def __init__(self, layer_names):
+        self.layer_names = list(layer_names)
+        self.alpha = tf.Variable(0.0, trainable=False)
+        self.beta = tf.Variable(0.0, trainable=False)
+        self.layer_weights = [tf.Variable(0.0, trainable=False) for _ in self.layer_names]
+        self.style_layers = list(zip(self.layer_names, self.layer_weights))
+        weights = [self.alpha, self.beta] + self.layer_weights
+        self._values = [tf.placeholder('float32', ()) for _ in weights]
+        self._load = tf.group(*[weight.assign(value)
+                                for weight, value in zip(weights, self._values)])
+
+    def load(self, sess, alpha, beta, style_layers):
+        """
+        Loads alpha, beta and the weights of style_layers, which must hold
+        the layers of layer_names in the same order.
+        """
+        if [layer_name for layer_name, _ in style_layers] != self.layer_names:
+            raise ValueError('Weights of %s, expected %s' % (
+                [layer_name for layer_name, _ in style_layers], self.layer_names))
+        values = [alpha, beta] + [weight for _, weight in style_layers]
+        sess.run(self._load, feed_dict=dict(zip(self._values, values)))
+
+
+def loss_terms_func(sess, model, content_features, grams, alpha=ALPHA, beta=BETA,
+                    content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS, masks=None):
+    """
+    Instantiate equation 7 of the paper from the content and style targets,
+    given as arrays or as the variables of a Targets. alpha, beta and the
+    weights of style_layers may be numbers or the variables of a
+    LossWeights. With masks the style term paints a style per region, see
+    style_loss_func.
+    Returns a dict of loss tensors: 'total' is the loss to minimize,
+    'content' and 'style' are the two terms before weighting by beta and
+    alpha, and 'style/<layer>' is the weighted term of every style layer.
+    """
+    content_loss = content_loss_func(sess, model, content_features, content_layer)
+    style_loss, layer_losses = style_loss_func(sess, model, grams, style_layers,
+                                               return_layer_losses=True, masks=masks)
+    terms = {
+        'total': beta * content_loss + alpha * style_loss,
+        'content': content_loss,
+        'style': style_loss,
+    }
+    for layer_name, layer_loss in layer_losses.items():
+        terms['style/' + layer_name] = layer_loss
+    return terms
+
+
+def _notify(observers, method, *args):
+    """
+    Calls method on every observer.
+    """
+    for observer in observers:
+        getattr(observer, method)(*args)
+
+
+class AdamPainter(object):
+    """
+    Paints model['input'] with Adam.
+    Every op is built here, so the graph can be finalized once painters are
+    built and the same painter can paint any number of images. At report
+    iterations the loss terms and the image are fetched in the same run as
+    the training step, so reporting costs no extra forward pass. After a
+    run, info holds the number of iterations run, the final loss, the
+    seconds spent and the reason the run stopped, and history the total
+    loss of every iteration it was fetched at, as (iteration, loss) pairs.
+    A run can write checkpoints of the image, the Adam slots and step
+    count, and the history, and resume goes on from a checkpoint with the
+    same results as a run that was never stopped.
+    """
+
+    def __init__(self, sess, model, loss_terms, learning_rate=LEARNING_RATE):
+        self.sess = sess
+        self.model = model
+        self.loss_terms = loss_terms
+        self.optimizer = tf.train.AdamOptimizer(learning_rate)
+        self.train_step = self.optimizer.minimize(loss_terms['total'], var_list=[model['input']])
+        # Image after the training step of the same run.
+        with tf.control_dependencies([self.train_step]):
+            self.image_after_step = model['input'].read_value()
+        # Loads an initial image and resets the optimizer state.
+        self.image_value = tf.placeholder('float32', model['input'].get_shape())
+        self.reset = tf.group(
+            model['input'].assign(self.image_value),
+            tf.variables_initializer(self.optimizer.variables()))
+        # The state saved in checkpoints: the image, the Adam slots and the
+        # powers of the decay rates, which count the steps.
+        self.state_variables = [model['input']] + self.optimizer.variables()
+        self._state_values = [tf.placeholder(variable.dtype.base_dtype, variable.get_shape())
+                              for variable in self.state_variables]
+        self._load_state = tf.group(*[variable.assign(value) for variable, value
+                                      in zip(self.state_variables, self._state_values)])
+        self.info = None
+        self.history = []
+
+    def run(self, initial_image, iterations=ITERATIONS, observers=(),
+            report_every=REPORT_EVERY, profiler=None, tolerance=None,
+            target_loss=None, check_every=CHECK_EVERY, checkpoint=None,
+            checkpoint_every=CHECKPOINT_EVERY):
+        """
+        Runs iterations Adam steps from initial_image and returns the
+        painted image. observers are notified every report_every iterations
+        and after the last one. The steps a profiling.Profiler wants are
+        traced and added to it.
+        Every check_every iterations the run stops early once the total
+        loss is at most target_loss, or once it changed by less than
+        tolerance, relative to its value at the previous check.
+        With checkpoint, a path, the state is saved there every
+        checkpoint_every iterations and at the end of the run.
+        """
+        start = time.time()
+        self.sess.run(self.reset, feed_dict={self.image_value: initial_image})
+        _notify(observers, 'on_start', initial_image)
+        return self._run(0, iterations, observers, report_every, profiler, tolerance,
+                         target_loss, check_every, checkpoint, checkpoint_every,
+                         start, [], None)
+
+    def resume(self, checkpoint, iterations=ITERATIONS, observers=(),
+               report_every=REPORT_EVERY, profiler=None, tolerance=None,
+               target_loss=None, check_every=CHECK_EVERY, checkpoint_every=CHECKPOINT_EVERY):
+        """
+        Loads the state saved by a run at checkpoint and runs the steps left
+        until iterations steps in all, e.g. the rest of a run that was
+        stopped, or more steps for a run that was done. Returns the painted
+        image, and keeps saving to checkpoint like run. Iterations are
+        numbered from the start of the first run, so reports fall on the
+        same iterations as in a run that was never stopped.
+        """
+        state = load_checkpoint(checkpoint)
+        if len(state['values']) != len(self.state_variables) or any(
+                value.shape != tuple(variable.get_shape().as_list())
+                for value, variable in zip(state['values'], self.state_variables)):
+            raise ValueError('Checkpoint %s does not match this painter' % checkpoint)
+        start = time.time() - state['info'].get('seconds', 0.0)
+        self.sess.run(self._load_state, feed_dict=dict(zip(self._state_values, state['values'])))
+        _notify(observers, 'on_start', state['values'][0])
+        return self._run(state['step'], iterations, observers, report_every, profiler, tolerance,
+                         target_loss, check_every, checkpoint, checkpoint_every,
+                         start, state['history'], state['info'].get('previous_loss'))
+
+    def save(self, checkpoint, step, previous_loss=None, seconds=0.0):
+        """
+        Saves the state after step iterations to checkpoint.
+        """
+        values = self.sess.run(self.state_variables)
+        names = [variable.op.name for variable in self.state_variables]
+        save_checkpoint(checkpoint, names, values, step, self.history,
+                        {'previous_loss': previous_loss, 'seconds': seconds})
+
+    def _run(self, first, iterations, observers, report_every, profiler, tolerance,
+             target_loss, check_every, checkpoint, checkpoint_every, start, history,
+             previous_loss):
+        """
+        Runs the steps from first to iterations, see run.
+        """
+        sess = self.sess
+        self.history = list(history)
+        image = None
+        metrics = None
+        check = tolerance is not None or target_loss is not None
+        stop_reason = 'iterations done'
+        it = first - 1
+        for it in range(first, iterations):
+            trace = {}
+            if profiler is not None and profiler.wants(it):
+                trace = {'options': profiler.run_options, 'run_metadata': tf.RunMetadata()}
+            checking = check and it % check_every == 0
+            loss = None
+            if it % report_every == 0 or it == iterations - 1:
+                _, metrics, image = sess.run(
+                    [self.train_step, self.loss_terms, self.image_after_step], **trace)
+                _notify(observers, 'on_progress', it, image, metrics)
+                loss = metrics['total']
+            elif checking:
+                _, loss = sess.run([self.train_step, self.loss_terms['total']], **trace)
+            else:
+                sess.run(self.train_step, **trace)
+            if trace:
+                profiler.add(it, trace['run_metadata'])
+            if loss is not None:
+                self.history.append((it, float(loss)))
+            if checking:
+                if target_loss is not None and loss <= target_loss:
+                    stop_reason = 'target loss reached'
+                    break
+                if (tolerance is not None and previous_loss is not None
+                        and abs(previous_loss - loss) <= tolerance * abs(previous_loss)):
+                    stop_reason = 'loss converged'
+                    break
+                previous_loss = float(loss)
+            if checkpoint is not None and (it + 1) % checkpoint_every == 0 and it < iterations - 1:
+                self.save(checkpoint, it + 1, previous_loss, time.time() - start)
+        if metrics is None or it < iterations - 1:
+            image, metrics = sess.run([self.model['input'], self.loss_terms])
+        if checkpoint is not None:
+            self.save(checkpoint, it + 1, previous_loss, time.time() - start)
+        self.info = {
+            'iterations': it + 1,
+            'loss': float(metrics['total']),
+            'seconds': time.time() - start,
+            'stop_reason': stop_reason,
+        }
+        _notify(observers, 'on_finish', image, metrics)
+        return image
+
+
+def run_adam(sess, model, loss_terms, initial_image, iterations=ITERATIONS,
+             learning_rate=LEARNING_RATE, observers=()):
+    """
+    Minimizes the total loss over model['input'] with a fixed number of
+    Adam steps starting from initial_image, and returns the painted image.
+    """
+    painter = AdamPainter(sess, model, loss_terms, learning_rate)
+    return painter.run(initial_image, iterations, observers)
+
+
+class _TimeBudgetExceeded(Exception):
+    """
+    Raised from the L-BFGS callback to stop once the time budget is spent.
+    """
+    pass
+
+
+def pixel_bounds(shape):
+    """
+    Returns the (lower, upper) bound of every pixel of an image with the
+    given shape, so that the painted image stays within 0 and 255 once the
+    mean is added back.
+    """
+    lower = np.broadcast_to(-MEAN_VALUES, shape).ravel()
+    upper = np.broadcast_to(255 - MEAN_VALUES, shape).ravel()
+    return np.stack([lower, upper], axis=1)
+
+
+class LbfgsPainter(object):
+    """
+    Paints model['input'] with scipy's L-BFGS-B.
+    Pixels are kept within their valid range by the optimizer's bounds
+    instead of clipping. Like AdamPainter every op is built here, and the
+    loss terms reported to observers come from the same run as the
+    gradient. After a run, info holds the number of iterations, the final
+    loss, the seconds spent and the reason the run stopped.
+    """
+
+    def __init__(self, sess, model, loss_terms, max_iterations=LBFGS_MAX_ITERATIONS,
+                 ftol=LBFGS_FTOL, time_budget=TIME_BUDGET):
+        self.sess = sess
+        self.model = model
+        self.loss_terms = loss_terms
+        self.max_iterations = max_iterations
+        self.ftol = ftol
+        self.time_budget = time_budget
+        self.shape = model['input'].get_shape().as_list()
+        self.gradient = tf.gradients(loss_terms['total'], model['input'])[0]
+        self.image_value = tf.placeholder('float32', self.shape)
+        self.load_input = model['input'].assign(self.image_value)
+        self.info = None
+
+    def run(self, initial_image, iterations=None, observers=(),
+            report_every=REPORT_EVERY, profiler=None):
+        """
+        Minimizes the total loss starting from initial_image and returns the
+        painted image. iterations overrides max_iterations if given. The
+        loss and gradient evaluations a profiling.Profiler wants are traced
+        and added to it, numbered in the order they are run.
+        """
+        sess = self.sess
+        shape = self.shape
+        if iterations is None:
+            iterations = self.max_iterations
+        state = {'x': np.asarray(initial_image, dtype=np.float64).ravel(),
+                 'metrics': None, 'iterations': 0, 'evaluations': 0}
+        last_eval = {}
+        start = time.time()
+
+        def _loss_and_gradient(x):
+            """
+            Returns the loss and its gradient at x, in float64 for scipy.
+            """
+            sess.run(self.load_input, feed_dict={self.image_value: x.reshape(shape)})
+            evaluation = state['evaluations']
+            state['evaluations'] += 1
+            trace = {}
+            if profiler is not None and profiler.wants(evaluation):
+                trace = {'options': profiler.run_options, 'run_metadata': tf.RunMetadata()}
+            metrics, grad = sess.run([self.loss_terms, self.gradient], **trace)
+            if trace:
+                profiler.add(evaluation, trace['run_metadata'])
+            last_eval['x'] = x.copy()
+            last_eval['metrics'] = metrics
+            return float(metrics['total']), grad.ravel().astype(np.float64)
+
+        def _callback(x):
+            """
+            Records every accepted iterate, reports progress and checks the
+            time budget.
+            """
+            it = state['iterations']
+            state['iterations'] += 1
+            state['x'] = np.array(x)
+            if last_eval.get('x') is not None and np.array_equal(last_eval['x'], x):
+                state['metrics'] = last_eval['metrics']
+            if it % report_every == 0 and state['metrics'] is not None:
+                _notify(observers, 'on_progress', it,
+                        x.reshape(shape).astype(np.float32), state['metrics'])
+            if self.time_budget is not None and time.time() - start > self.time_budget:
+                raise _TimeBudgetExceeded()
+
+        _notify(observers, 'on_start', initial_image)
+        try:
+            result = scipy.optimize.minimize(
+                _loss_and_gradient, state['x'], jac=True, method='L-BFGS-B',
+                bounds=pixel_bounds(shape), callback=_callback,
+                options={'maxiter': iterations, 'ftol': self.ftol})
+            state['x'] = result.x
+            stop_reason = str(result.message)
+        except _TimeBudgetExceeded:
+            stop_reason = 'time budget exceeded'
+
+        image = state['x'].reshape(shape).astype(np.float32)
+        sess.run(self.load_input, feed_dict={self.image_value: image})
+        if last_eval.get('x') is not None and np.array_equal(last_eval['x'], state['x']):
+            metrics = last_eval['metrics']
+        else:
+            metrics = sess.run(self.loss_terms)
+        self.info = {
+            'iterations': state['iterations'],
+            'loss': float(metrics['total']),
+            'seconds': time.time() - start,
+            'stop_reason': stop_reason,
+        }
+        _notify(observers, 'on_finish', image, metrics)
+        return image
+
+
+def minimize_lbfgs(sess, model, loss_terms, initial_image,
+                   max_iterations=LBFGS_MAX_ITERATIONS, ftol=LBFGS_FTOL,
+                   time_budget=TIME_BUDGET, observers=()):
+    """
+    Minimizes the total loss over model['input'] with L-BFGS-B, starting
+    from initial_image, and returns the painted image and the run's info,
+    see LbfgsPainter.
+    """
+    painter = LbfgsPainter(sess, model, loss_terms, max_iterations, ftol, time_budget)
+    image = painter.run(initial_image, observers=observers)
+    return image, painter.info
+
+
+def make_painter(sess, model, loss_terms, optimizer='adam'):
+    """
+    Returns an AdamPainter for 'adam' or an LbfgsPainter for 'lbfgs'.
+    """
+    if optimizer == 'adam':
+        return AdamPainter(sess, model, loss_terms)
+    elif optimizer == 'lbfgs':
+        return LbfgsPainter(sess, model, loss_terms)
+    else:
+        raise ValueError('Unknown optimizer %s' % optimizer)
+
+
+def optimize(sess, model, loss_terms, initial_image, iterations=ITERATIONS,
+             optimizer='adam', observers=()):
+    """
+    Runs the 'adam' or 'lbfgs' optimizer and returns the painted image.
+    For 'lbfgs' iterations is the maximum number of iterations.
+    """
+    painter = make_painter(sess, model, loss_terms, optimizer)
+    return painter.run(initial_image, iterations, observers)
+
+
+def stylize_batch(model_path, content_images, style_images,
+                  iterations=ITERATIONS, alpha=ALPHA, beta=BETA,
+                  noise_ratio=NOISE_RATIO, content_layer=CONTENT_LAYER,
+                  style_layers=STYLE_LAYERS, optimizer='adam', observers=()):
+    """
+    Paints N content images in one optimization and returns the N painted
+    images, each with shape (1, H, W, 3).
+    content_images and style_images are lists of images as returned by
+    load_image, one style image per content image; the same style may be
+    used by several content images. The images are held by one
+    (N, H, W, 3) variable and every image keeps its own content and style
+    targets. The loss terms of different images do not interact and Adam
+    updates every pixel on its own, so each image follows the same path as
+    in a run of its own, while the convolutions work on N images at once.
+    """
+    content_images = np.concatenate(content_images, axis=0)
+    batch_size, height, width, _ = content_images.shape
+    graph = tf.Graph()
+    with graph.as_default():
+        model = load_vgg_model(model_path, model_layers(content_layer, style_layers),
+                               batch_size, height, width)
+        sess = tf.Session()
+        content_features, grams = extract_batch_targets(
+            sess, model, content_images, style_images, content_layer, style_layers)
+        loss_terms = loss_terms_func(sess, model, content_features, grams, alpha, beta,
+                                     content_layer, style_layers)
+        painter = make_painter(sess, model, loss_terms, optimizer)
+        graph.finalize()
+        mixed_images = painter.run(generate_noise_image(content_images, noise_ratio),
+                                   iterations, observers)
+        sess.close()
+    return [mixed_images[n:n + 1] for n in range(batch_size)]
+
+
+def stylize_regions(model_path, content_image, style_images, masks,
+                    iterations=ITERATIONS, alpha=ALPHA, beta=BETA,
+                    noise_ratio=NOISE_RATIO, content_layer=CONTENT_LAYER,
+                    style_layers=STYLE_LAYERS, optimizer='adam', observers=()):
+    """
+    Paints every region of content_image with its own style in a single
+    optimization and returns the painted image.
+    style_images holds one style image per region and masks one mask per
+    region as returned by load_mask, with the size of the content image,
+    e.g. a Grabcut foreground mask and its complement 1 - mask. The style
+    images are brought to the size of the content image. K regions cost
+    one optimization, only the gram matrices are computed K times.
+    """
+    _, height, width, _ = content_image.shape
+    style_images = [resize_image(style_image, height, width) for style_image in style_images]
+    masks = np.concatenate(masks, axis=0).astype(np.float32)
+    graph = tf.Graph()
+    with graph.as_default():
+        model = load_vgg_model(model_path, model_layers(content_layer, style_layers),
+                               1, height, width)
+        sess = tf.Session()
+        content_features, _ = extract_targets(sess, model, content_image, None,
+                                              content_layer, style_layers)
+        grams = extract_style_grams(sess, model, style_images, style_layers)
+        loss_terms = loss_terms_func(sess, model, content_features, grams, alpha, beta,
+                                     content_layer, style_layers, masks)
+        painter = make_painter(sess, model, loss_terms, optimizer)
+        graph.finalize()
+        mixed_image = painter.run(generate_noise_image(content_image, noise_ratio),
+                                  iterations, observers)
+        sess.close()
+    return mixed_image
+
+
+def stylize_pyramid(model_path, content_image, style_image,
+                    scales=PYRAMID_SCALES, iterations=PYRAMID_ITERATIONS,
+                    alpha=ALPHA, beta=BETA, noise_ratio=NOISE_RATIO,
+                    content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS,
+                    optimizer='adam', observers=()):
+    """
+    Paints content_image coarse to fine and returns the painted image.
+    The image is first painted from noise at the smallest of scales, then
+    every result is upsampled to initialize the next, larger, level. The
+    cheap small levels settle the low frequency structure so only a few
+    iterations are needed at full resolution. iterations holds the number
+    of iterations of every level. The style image is resized along with
+    the content image at every level. observers are notified at every level.
+    The weights are loaded once and shared by the models of every level.
+    """
+    _, full_height, full_width, _ = content_image.shape
+    weights = load_vgg_weights(model_path)
+    mixed_image = None
+    for scale, level_iterations in zip(scales, iterations):
+        height = int(round(full_height * scale))
+        width = int(round(full_width * scale))
+        level_content = resize_image(content_image, height, width)
+        level_style = resize_image(style_image, height, width)
+        if mixed_image is None:
+            initial_image = generate_noise_image(level_content, noise_ratio)
+        else:
+            initial_image = resize_image(mixed_image, height, width)
+
+        graph = tf.Graph()
+        with graph.as_default():
+            model = load_vgg_model(weights, model_layers(content_layer, style_layers),
+                                   1, height, width)
+            sess = tf.Session()
+            content_features, grams = extract_targets(
+                sess, model, level_content, level_style, content_layer, style_layers)
+            loss_terms = loss_terms_func(sess, model, content_features, grams, alpha, beta,
+                                         content_layer, style_layers)
+            painter = make_painter(sess, model, loss_terms, optimizer)
+            graph.finalize()
+            mixed_image = painter.run(initial_image, level_iterations, observers)
+            sess.close()
+    return mixed_image
@@ -0,0 +1,319 @@
+# This script sweeps the loss weights of the style transfer for one
+# content and style image: ALPHA, BETA, NOISE_RATIO and the weights of the
+# style layers, building the model and extracting the targets only once
+#
+# usage: python sweep.py images/hongkong.jpg images/guernica.jpg
+#                        [--alpha 50 100] [--beta 5 10] [--noise 0.6]
+#                        [--output output/sweep/] [--processes 2]
+import os
+import json
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from PIL import Image, ImageDraw
+
+from vgg_model import load_vgg_model, load_vgg_weights, load_image, extract_targets
+from vgg_model import extract_gram_ops, content_loss_func, style_loss_func, deprocess_image
+from vgg_model import VGG_LAYERS, CONTENT_LAYER, STYLE_LAYERS, NOISE_RATIO, IMAGE_HEIGHT, IMAGE_WIDTH
+from stylize import Targets, AdamPainter
+from stylize import ALPHA, BETA
+from progress import HistoryObserver
+
+
+# Number of configurations painted together as one batch.
+SWEEP_BATCH = 4
+# Number of iterations of every configuration.
+SWEEP_ITERATIONS = 200
+# The loss of every configuration is recorded every CURVE_EVERY iterations.
+CURVE_EVERY = 10
+# Width of the pictures of the contact sheet, and its number of columns.
+THUMBNAIL_WIDTH = 256
+SHEET_COLUMNS = 4
+
+
+def sweep_grid(alphas=(ALPHA,), betas=(BETA,), noise_ratios=(NOISE_RATIO,),
+               style_layer_sets=(STYLE_LAYERS,)):
+    """
+    Returns the configurations of every combination of the given values, as
+    dicts with 'alpha', 'beta', 'noise_ratio' and 'style_layers'.
+    """
+    return [{'alpha': alpha, 'beta': beta, 'noise_ratio': noise_ratio,
+             'style_layers': list(style_layers)}
+            for alpha, beta, noise_ratio, style_layers
+            in itertools.product(alphas, betas, noise_ratios, style_layer_sets)]
+
+
+def sweep_layers(configs):
+    """
+    Returns the names of the style layers used by any configuration, in
+    network order.
+    """
+    used = set(layer_name for config in configs for layer_name, _ in config['style_layers'])
+    return [layer_name for layer_name, _ in VGG_LAYERS if layer_name in used]
+
+
+class SweepPainter(object):
+    """
+    Paints batch_size configurations at once with one model.
+    The style layers of all configurations are held by one loss whose
+    weights are variables with one value per image, alpha and beta as well,
+    so any configuration is painted by loading its weights: the graph is
+    built once for the whole sweep. Images of a batch do not interact, so
+    each follows the path of a run of its own.
+    """
+
+    def __init__(self, model_path, height, width, layer_names, batch_size=SWEEP_BATCH,
+                 content_layer=CONTENT_LAYER, config=None):
+        self.layer_names = layer_names
+        self.batch_size = batch_size
+        self.content_layer = content_layer
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = tf.Session(config=config)
+            self.model = load_vgg_model(model_path, [content_layer] + layer_names,
+                                        batch_size, height, width)
+            self.sess.run(self.model['input'].initializer)
+            style_layers = [(layer_name, 1.0) for layer_name in layer_names]
+            self.targets = Targets(self.model, content_layer, style_layers)
+            self.alpha = tf.Variable(tf.zeros(batch_size), trainable=False)
+            self.beta = tf.Variable(tf.zeros(batch_size), trainable=False)
+            self.weights = tf.Variable(tf.zeros((batch_size, len(layer_names))), trainable=False)
+            self._values = [tf.placeholder('float32', variable.get_shape())
+                            for variable in (self.alpha, self.beta, self.weights)]
+            self._load = tf.group(*[variable.assign(value) for variable, value
+                                    in zip((self.alpha, self.beta, self.weights), self._values)])
+            self.loss_terms = self._loss_terms()
+            self.painter = AdamPainter(self.sess, self.model, self.loss_terms)
+            extract_gram_ops(self.model, style_layers)
+            self.graph.finalize()
+
+    def _loss_terms(self):
+        """
+        Returns the loss terms; 'config' holds the total loss of every image.
+        """
+        content = content_loss_func(self.sess, self.model, self.targets.content,
+                                    self.content_layer, per_image=True)
+        style_layers = [(layer_name, self.weights[:, l])
+                        for l, layer_name in enumerate(self.layer_names)]
+        style = style_loss_func(self.sess, self.model, self.targets.grams, style_layers,
+                                per_image=True)
+        config_total = self.beta * content + self.alpha * style
+        return {
+            'total': tf.reduce_sum(config_total),
+            'config': config_total,
+            'content': content,
+            'style': style,
+        }
+
+    def load_targets(self, content_features, grams):
+        """
+        Loads the content features and the gram matrices of every layer of
+        layer_names, shared by all configurations.
+        """
+        content = np.repeat(content_features, self.batch_size, axis=0)
+        self.targets.load(self.sess, content, grams)
+
+    def extract(self, content_image, style_image):
+        """
+        Returns the content features and gram matrices of the images.
+        """
+        style_layers = [(layer_name, 1.0) for layer_name in self.layer_names]
+        return extract_targets(self.sess, self.model, content_image, style_image,
+                               self.content_layer, style_layers)
+
+    def paint(self, configs, content_image, noise, iterations=SWEEP_ITERATIONS):
+        """
+        Paints up to batch_size configurations, all starting from the same
+        noise mixed with the content image by their noise ratio. Returns the
+        painted image and loss curve, a list of (iteration, loss), of every
+        configuration.
+        """
+        # A short batch is filled up with copies of its last configuration.
+        batch = list(configs) + [configs[-1]] * (self.batch_size - len(configs))
+        weights = np.zeros((self.batch_size, len(self.layer_names)), dtype=np.float32)
+        for n, config in enumerate(batch):
+            for layer_name, weight in config['style_layers']:
+                weights[n, self.layer_names.index(layer_name)] = weight
+        self.sess.run(self._load, feed_dict=dict(zip(self._values, [
+            [config['alpha'] for config in batch],
+            [config['beta'] for config in batch],
+            weights])))
+        initial_image = np.concatenate([
+            noise * config['noise_ratio'] + content_image * (1 - config['noise_ratio'])
+            for config in batch], axis=0).astype(np.float32)
+        history = HistoryObserver()
+        mixed_images = self.painter.run(initial_image, iterations, [history],
+                                        report_every=CURVE_EVERY)
+        results = []
+        for n in range(len(configs)):
+            curve = [(it, float(metrics['config'][n])) for it, metrics in history.history]
+            results.append((mixed_images[n:n + 1], curve))
+        return results
+
+    def close(self):
+        self.sess.close()
+
+
+# SweepPainter of a process of the pool.
+_pool_painter = None
+
+
+def _init_pool(weights, height, width, layer_names, batch_size, content_layer,
+               content_features, grams, threads):
+    """
+    Builds the painter of a pool process, once for all its batches.
+    """
+    global _pool_painter
+    config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                            inter_op_parallelism_threads=1) if threads else None
+    _pool_painter = SweepPainter(weights, height, width, layer_names, batch_size,
+                                 content_layer, config)
+    _pool_painter.load_targets(content_features, grams)
+
+
+def _paint_in_pool(args):
+    configs, content_image, noise, iterations = args
+    return _pool_painter.paint(configs, content_image, noise, iterations)
+
+
+def run_sweep(model_path, content_image, style_image, configs,
+              iterations=SWEEP_ITERATIONS, batch_size=SWEEP_BATCH, processes=None,
+              content_layer=CONTENT_LAYER, seed=0):
+    """
+    Paints every configuration and returns a list of dicts holding the
+    'config', the painted 'image', the loss 'curve' and the final 'loss'.
+    The targets are extracted once. Configurations are painted batch_size
+    at a time, by this process or, with processes, by a pool of processes
+    each building its model once and sharing the CPU cores evenly. All
+    configurations start from the same noise, so they differ only by their
+    weights.
+    """
+    _, height, width, _ = content_image.shape
+    layer_names = sweep_layers(configs)
+    batch_size = min(batch_size, len(configs))
+    noise = np.random.RandomState(seed).uniform(-20, 20, content_image.shape).astype('float32')
+    batches = [configs[first:first + batch_size] for first in range(0, len(configs), batch_size)]
+
+    weights = load_vgg_weights(model_path)
+    painter = SweepPainter(weights, height, width, layer_names, batch_size, content_layer)
+    content_features, grams = painter.extract(content_image, style_image)
+    if processes:
+        painter.close()
+        threads = max(multiprocessing.cpu_count() // processes, 1)
+        # The pool gets the path, so every process memory maps the same
+        # weight store instead of receiving a copy of the weights.
+        pool = multiprocessing.get_context('spawn').Pool(
+            processes, _init_pool,
+            (model_path, height, width, layer_names, batch_size, content_layer,
+             content_features, grams, threads))
+        try:
+            painted = pool.map(_paint_in_pool, [(batch, content_image, noise, iterations)
+                                                for batch in batches])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        painter.load_targets(content_features, grams)
+        painted = [painter.paint(batch, content_image, noise, iterations) for batch in batches]
+        painter.close()
+
+    results = []
+    for batch, batch_results in zip(batches, painted):
+        for config, (image, curve) in zip(batch, batch_results):
+            results.append({'config': config, 'image': image, 'curve': curve,
+                            'loss': curve[-1][1] if curve else None})
+    return results
+
+
+def config_label(config):
+    """
+    Returns a short description of a configuration.
+    """
+    layers = ' '.join('%s:%g' % (layer_name, weight)
+                      for layer_name, weight in config['style_layers'])
+    return 'a=%g b=%g n=%g %s' % (config['alpha'], config['beta'], config['noise_ratio'], layers)
+
+
+def contact_sheet(results, path, columns=SHEET_COLUMNS, thumbnail_width=THUMBNAIL_WIDTH):
+    """
+    Writes the painted images of a sweep side by side, each labelled with
+    its configuration and final loss.
+    """
+    thumbnails = []
+    for result in results:
+        picture = Image.fromarray(deprocess_image(result['image']))
+        height = int(round(picture.height * float(thumbnail_width) / picture.width))
+        thumbnails.append(picture.resize((thumbnail_width, height), Image.BILINEAR))
+    label_height = 28
+    cell_height = max(thumbnail.height for thumbnail in thumbnails) + label_height
+    columns = min(columns, len(thumbnails))
+    rows = (len(thumbnails) + columns - 1) // columns
+    sheet = Image.new('RGB', (columns * thumbnail_width, rows * cell_height), 'white')
+    draw = ImageDraw.Draw(sheet)
+    for n, (result, thumbnail) in enumerate(zip(results, thumbnails)):
+        left = (n % columns) * thumbnail_width
+        top = (n // columns) * cell_height
+        sheet.paste(thumbnail, (left, top))
+        label = config_label(result['config'])
+        # Layer weights are cut to fit, the report holds them in full.
+        draw.text((left + 2, top + thumbnail.height + 2), label[:40], fill='black')
+        draw.text((left + 2, top + thumbnail.height + 14), 'loss %g' % result['loss'], fill='black')
+    sheet.save(path)
+
+
+def plot_loss_curves(results, path):
+    """
+    Plots the loss curve of every configuration, on a log scale.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    figure = plt.figure(figsize=(10, 6))
+    for n, result in enumerate(results):
+        iterations = [it for it, _ in result['curve']]
+        losses = [loss for _, loss in result['curve']]
+        plt.plot(iterations, losses, label='%d: %s' % (n, config_label(result['config'])))
+    plt.yscale('log')
+    plt.xlabel('iteration')
+    plt.ylabel('total loss')
+    plt.legend(fontsize='x-small')
+    figure.savefig(path)
+    plt.close(figure)
+
+
+def write_report(results, path):
+    """
+    Writes the configuration, final loss and loss curve of every result.
+    """
+    report = [{'config': result['config'], 'loss': result['loss'], 'curve': result['curve']}
+              for result in results]
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the loss weights.')
+    parser.add_argument('content', help='content image')
+    parser.add_argument('style', help='style image')
+    parser.add_argument('--model', default='imagenet-vgg-verydeep-19/',
+                        help='vgg weight store folder or .pkl file')
+    parser.add_argument('--alpha', type=float, nargs='+', default=[ALPHA])
+    parser.add_argument('--beta', type=float, nargs='+', default=[BETA])
+    parser.add_argument('--noise', type=float, nargs='+', default=[NOISE_RATIO])
+    parser.add_argument('--iterations', type=int, default=SWEEP_ITERATIONS)
+    parser.add_argument('--processes', type=int, help='paint batches in a process pool')
+    parser.add_argument('--output', default='output/sweep/', help='output folder')
+    args = parser.parse_args()
+
+    content_image = load_image(args.content, IMAGE_HEIGHT, IMAGE_WIDTH)
+    style_image = load_image(args.style, IMAGE_HEIGHT, IMAGE_WIDTH)
+    configs = sweep_grid(args.alpha, args.beta, args.noise)
+    results = run_sweep(args.model, content_image, style_image, configs,
+                        args.iterations, processes=args.processes)
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    contact_sheet(results, os.path.join(args.output, 'sheet.png'))
+    write_report(results, os.path.join(args.output, 'report.json'))
+    plot_loss_curves(results, os.path.join(args.output, 'curves.png'))
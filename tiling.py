@@ -0,0 +1,174 @@
+# This script paints images too large for one model, such as print size
+# photos, tile by tile and feathers the tiles back together
+import numpy as np
+
+from vgg_model import model_layers, extract_targets, generate_noise_image, resize_image
+from vgg_model import CONTENT_LAYER, STYLE_LAYERS, NOISE_RATIO
+from stylize import Targets, loss_terms_func, make_painter
+from stylize import ALPHA, BETA, ITERATIONS
+from model_cache import ModelCache
+
+
+# Size of the square tiles, and how much neighbouring tiles overlap.
+TILE_SIZE = 512
+TILE_OVERLAP = 64
+# Number of tiles painted together in one batch. Peak memory grows with
+# TILE_SIZE and PARALLEL_TILES, not with the size of the image.
+PARALLEL_TILES = 2
+
+
+def tile_starts(length, tile_size, overlap):
+    """
+    Returns the offsets of the tiles covering length, neighbouring tiles
+    overlapping by at least overlap. The last tile ends with the image.
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def feather_window(tile_height, tile_width, overlap, top, left, bottom, right):
+    """
+    Returns the blending weights of a tile: 1 inside, ramping down across
+    the overlap on the sides that have a neighbour (top, left, bottom and
+    right are True for those sides).
+    """
+    def _ramp(length, start_edge, end_edge):
+        ramp = np.ones(length, dtype=np.float32)
+        if overlap > 0:
+            edge = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+            size = min(overlap, length)
+            if start_edge:
+                ramp[:size] = np.minimum(ramp[:size], edge[:size])
+            if end_edge:
+                ramp[-size:] = np.minimum(ramp[-size:], edge[:size][::-1])
+        return ramp
+
+    return np.outer(_ramp(tile_height, top, bottom), _ramp(tile_width, left, right))
+
+
+def style_targets(cache, style_image, tile_height, tile_width,
+                  content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS):
+    """
+    Returns the style gram matrices to use as targets for tiles of
+    tile_height x tile_width.
+    The style image is brought to about the number of pixels of one tile so
+    that its extraction stays within the same memory, and every gram matrix
+    is rescaled from the size of the style feature map to the size of a
+    tile's feature map, as a gram matrix is a sum over positions.
+    """
+    _, height, width, _ = style_image.shape
+    scale = min(1.0, np.sqrt(float(tile_height * tile_width) / (height * width)))
+    height = max(int(round(height * scale)), 1)
+    width = max(int(round(width * scale)), 1)
+    style_image = resize_image(style_image, height, width)
+    layers = model_layers(content_layer, style_layers)
+    # Only the shapes of the tile model are used, so it is fine if getting
+    # the style model starts the cache's graph afresh.
+    tile_model = cache.get(tile_height, tile_width, layers)
+    style_model = cache.get(height, width, layers)
+    with cache.graph.as_default():
+        _, grams = extract_targets(cache.sess, style_model, None, style_image,
+                                   content_layer, style_layers)
+    scaled = []
+    for gram, (layer_name, _) in zip(grams, style_layers):
+        _, style_h, style_w, _ = style_model[layer_name].get_shape().as_list()
+        _, tile_h, tile_w, _ = tile_model[layer_name].get_shape().as_list()
+        scaled.append(gram * (float(tile_h * tile_w) / (style_h * style_w)))
+    return scaled
+
+
+def stylize_tiled(model_path, content_image, style_image,
+                  tile_size=TILE_SIZE, overlap=TILE_OVERLAP, parallel=PARALLEL_TILES,
+                  iterations=ITERATIONS, alpha=ALPHA, beta=BETA,
+                  noise_ratio=NOISE_RATIO, content_layer=CONTENT_LAYER,
+                  style_layers=STYLE_LAYERS, optimizer='adam', observers=(),
+                  cache=None):
+    """
+    Paints content_image of any size and returns the painted image.
+    The image is split into tiles overlapping by overlap pixels, and
+    parallel tiles at a time are painted together as one batch against
+    the same style gram matrices, computed once. Each tile keeps the
+    content target of its own region. Painted tiles are blended back with
+    feathered weights over the overlaps so no seams show.
+    model_path may be a model_cache.ModelCache, or one may be given as
+    cache, to reuse its warm models, and the loss and painter of earlier
+    calls with the same tile size and settings.
+    """
+    if overlap < 0 or overlap >= tile_size:
+        raise ValueError('Tile overlap must be at least 0 and below the tile size %d, got %d' % (
+            tile_size, overlap))
+    own_cache = False
+    if cache is None:
+        if isinstance(model_path, ModelCache):
+            cache = model_path
+        else:
+            cache = ModelCache(model_path)
+            own_cache = True
+    try:
+        return _stylize_tiles(cache, content_image, style_image, tile_size, overlap, parallel,
+                              iterations, alpha, beta, noise_ratio, content_layer,
+                              style_layers, optimizer, observers)
+    finally:
+        if own_cache:
+            cache.close()
+
+
+def _stylize_tiles(cache, content_image, style_image, tile_size, overlap, parallel,
+                   iterations, alpha, beta, noise_ratio, content_layer, style_layers,
+                   optimizer, observers):
+    """
+    Paints content_image with the models of cache, see stylize_tiled.
+    """
+    _, height, width, channels = content_image.shape
+    tile_height = min(tile_size, height)
+    tile_width = min(tile_size, width)
+    grams = style_targets(cache, style_image, tile_height, tile_width,
+                          content_layer, style_layers)
+
+    tiles = [(top, left)
+             for top in tile_starts(height, tile_size, overlap)
+             for left in tile_starts(width, tile_size, overlap)]
+    parallel = min(parallel, len(tiles))
+    layers = model_layers(content_layer, style_layers)
+    model = cache.get(tile_height, tile_width, layers, parallel)
+
+    def _build():
+        targets = Targets(model, content_layer, style_layers)
+        loss_terms = loss_terms_func(cache.sess, model, targets.content, targets.grams,
+                                     alpha, beta, content_layer, style_layers)
+        return targets, make_painter(cache.sess, model, loss_terms, optimizer)
+
+    settings = ('tiling', content_layer, tuple(style_layers), alpha, beta, optimizer)
+    targets, painter = cache.built(cache.key(tile_height, tile_width, layers, parallel),
+                                   settings, _build)
+
+    # The accumulators are as large as the image, float32 keeps them to
+    # the size of the image itself.
+    painted = np.zeros((1, height, width, channels), dtype=np.float32)
+    weights = np.zeros((1, height, width, 1), dtype=np.float32)
+    for first in range(0, len(tiles), parallel):
+        group = tiles[first:first + parallel]
+        # A short last group is filled up with copies of its first tile.
+        batch = group + [group[0]] * (parallel - len(group))
+        content_tiles = np.concatenate(
+            [content_image[:, top:top + tile_height, left:left + tile_width, :]
+             for top, left in batch], axis=0)
+        with cache.graph.as_default():
+            content_features, _ = extract_targets(cache.sess, model, content_tiles, None,
+                                                  content_layer, style_layers)
+        targets.load(cache.sess, content_features, grams)
+        mixed_tiles = painter.run(generate_noise_image(content_tiles, noise_ratio),
+                                  iterations, observers)
+        for n, (top, left) in enumerate(group):
+            window = feather_window(tile_height, tile_width, overlap,
+                                    top > 0, left > 0,
+                                    top + tile_height < height, left + tile_width < width)
+            window = window[np.newaxis, :, :, np.newaxis]
+            painted[:, top:top + tile_height, left:left + tile_width, :] += mixed_tiles[n:n + 1] * window
+            weights[:, top:top + tile_height, left:left + tile_width, :] += window
+    painted /= weights
+    return painted
@@ -1,4 +1,8 @@
 # This script transfer .mat VGG model to pickle .pkl file
+# or to a conv only weight store of memory mapped .npy files
+import os
+import json
+import hashlib
 import scipy.io
 import scipy.misc
 import numpy as np
@@ -83,3 +87,158 @@ def mat2pkl(vgg_path='imagenet-vgg-verydeep-19.mat'):
 
     vgg = {'meta': meta, 'layers': layers}
     pickle.dump(vgg, open("imagenet-vgg-verydeep-19.pkl", "wb"))
+
+
+# Names of the conv layers kept by the weight store, in network order.
+CONV_LAYERS = [
+    'conv1_1', 'conv1_2',
+    'conv2_1', 'conv2_2',
+    'conv3_1', 'conv3_2', 'conv3_3', 'conv3_4',
+    'conv4_1', 'conv4_2', 'conv4_3', 'conv4_4',
+    'conv5_1', 'conv5_2', 'conv5_3', 'conv5_4',
+]
+
+
+# Precisions the conv weights of a weight store can be saved in. Biases
+# are always kept in float32.
+STORE_PRECISIONS = ('float32', 'float16', 'int8')
+
+
+def quantize_int8(W):
+    """
+    quantize conv weights of shape (h, w, in, out) to int8 with one scale
+    per output channel, the largest absolute weight of the channel mapping
+    to 127
+    returns the int8 weights and the float32 scales
+    """
+    W = np.asarray(W, dtype=np.float32)
+    scale = np.abs(W).reshape(-1, W.shape[-1]).max(axis=0) / 127
+    # A channel of zeros keeps a scale of one.
+    scale[scale == 0] = 1
+    quantized = np.clip(np.round(W / scale), -127, 127).astype(np.int8)
+    return quantized, scale.astype(np.float32)
+
+
+class Int8Weights(object):
+    """
+    int8 conv weights with their per channel scales, as loaded from an int8
+    weight store; np.asarray gives the float32 weights back, so they are
+    only dequantized when a layer is actually built
+    """
+
+    def __init__(self, quantized, scale):
+        self.quantized = quantized
+        self.scale = scale
+        self.shape = quantized.shape
+
+    def __array__(self, dtype=None, copy=None):
+        W = np.asarray(self.quantized, dtype=np.float32) * np.asarray(self.scale)
+        return W if dtype is None else W.astype(dtype)
+
+
+def _save_array(store_dir, file_name, value):
+    """
+    save one array of a weight store and return its index entry
+    """
+    np.save(os.path.join(store_dir, file_name), value)
+    return {
+        'file': file_name,
+        'shape': list(value.shape),
+        'dtype': str(value.dtype),
+        'sha1': hashlib.sha1(value.tobytes()).hexdigest(),
+    }
+
+
+def write_weight_store(conv_weights, store_dir, precision='float32'):
+    """
+    write conv weights to a weight store folder
+    conv_weights maps layer index to (name, W, b); every array is saved as
+    its own .npy file and index.json records the layer index, name,
+    shapes and content digest of each file
+    precision is one of STORE_PRECISIONS: W is saved as float32, float16,
+    or int8 with a float32 scale per output channel, see quantize_int8
+    """
+    if precision not in STORE_PRECISIONS:
+        raise ValueError('Unknown precision %s' % precision)
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    index = {'format': 1, 'precision': precision, 'layers': []}
+    for layer_index in sorted(conv_weights):
+        name, W, b = conv_weights[layer_index]
+        if name not in CONV_LAYERS:
+            continue
+        entry = {'index': int(layer_index), 'name': name}
+        if precision == 'int8':
+            W, scale = quantize_int8(W)
+            entry['scale'] = _save_array(store_dir, '%s_scale.npy' % name, scale)
+        else:
+            W = np.ascontiguousarray(W, dtype=precision)
+        entry['W'] = _save_array(store_dir, '%s_W.npy' % name, W)
+        b = np.ascontiguousarray(b, dtype=np.float32).reshape(-1)
+        entry['b'] = _save_array(store_dir, '%s_b.npy' % name, b)
+        index['layers'].append(entry)
+    with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+
+def mat2npy(vgg_path='imagenet-vgg-verydeep-19.mat', store_dir='imagenet-vgg-verydeep-19/',
+            precision='float32'):
+    """
+    used to transfer .mat vgg model to a conv only weight store
+    the fully connected layers are dropped
+    """
+    vgg = scipy.io.loadmat(vgg_path)
+    vgg_layers = vgg['layers']
+    conv_weights = {}
+    for layer_index in range(43):
+        vgg_layer = vgg_layers[0][layer_index]
+        if vgg_layer[0][0][1][0] == 'conv':
+            name = str(vgg_layer[0][0][0][0])
+            W = vgg_layer[0][0][2][0][0]
+            b = vgg_layer[0][0][2][0][1]
+            conv_weights[layer_index] = (name, W, b)
+    write_weight_store(conv_weights, store_dir, precision)
+
+
+def pkl2npy(pkl_path='imagenet-vgg-verydeep-19.pkl', store_dir='imagenet-vgg-verydeep-19/',
+            precision='float32'):
+    """
+    used to transfer a .pkl made by mat2pkl to a conv only weight store
+    """
+    vgg = pickle.load(open(pkl_path, 'rb'))
+    conv_weights = {}
+    for layer_index, layer in enumerate(vgg['layers']):
+        if layer['type'] == 'conv':
+            conv_weights[layer_index] = (
+                str(layer['name']), layer['weights']['W'], layer['weights']['b'])
+    write_weight_store(conv_weights, store_dir, precision)
+
+
+def convert_weight_store(src_dir, store_dir, precision):
+    """
+    used to write a weight store again in another precision, e.g. a
+    float16 or int8 copy of a float32 store
+    """
+    conv_weights = {}
+    for name, (layer_index, W, b) in load_weight_store(src_dir).items():
+        conv_weights[layer_index] = (name, np.asarray(W, dtype=np.float32), b)
+    write_weight_store(conv_weights, store_dir, precision)
+
+
+def load_weight_store(store_dir):
+    """
+    load a weight store made by mat2npy or pkl2npy
+    returns a dict from layer name to (index, W, b); arrays are memory mapped
+    read only, so only the pages of layers actually used are ever read
+    W of an int8 store is an Int8Weights, W of a float16 store is float16
+    """
+    with open(os.path.join(store_dir, 'index.json')) as f:
+        index = json.load(f)
+    weights = {}
+    for entry in index['layers']:
+        W = np.load(os.path.join(store_dir, entry['W']['file']), mmap_mode='r')
+        b = np.load(os.path.join(store_dir, entry['b']['file']), mmap_mode='r')
+        if 'scale' in entry:
+            W = Int8Weights(W, np.load(os.path.join(store_dir, entry['scale']['file'])))
+        weights[entry['name']] = (entry['index'], W, b)
+    return weights
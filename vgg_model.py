@@ -0,0 +1,741 @@
+# This script builds the VGG model, the losses and the image helpers
+# used by main.py, so that other scripts can reuse them
+import os
+import hashlib
+import numpy as np
+import scipy.io
+import scipy.ndimage
+import tensorflow as tf  # Import TensorFlow after Scipy or Scipy will break
+import pickle
+from PIL import Image
+
+from vgg_helper import load_weight_store
+
+
+###############################################################################
+# Constants for the image input and output.
+###############################################################################
+
+# Image dimensions constants.
+IMAGE_WIDTH = 800
+IMAGE_HEIGHT = 600
+COLOR_CHANNELS = 3
+# Noise ratio. Percentage of weight of the noise for intermixing with the
+# content image.
+NOISE_RATIO = 0.6
+# The mean to subtract from the input to the VGG model. This is the mean that
+# when the VGG was used to train. Minor changes to this will make a lot of
+# difference to the performance of model.
+MEAN_VALUES = np.array([123.68, 116.779, 103.939]).reshape((1,1,1,3))
+# How load_image brings images to the model size, see fit_image.
+RESIZE_POLICY = 'resize'
+# Tag of the preprocessing of load_image, part of the feature cache keys so
+# that targets of images loaded differently are never mixed. Change it
+# whenever load_image gives different pixels.
+PREPROCESSING = 'load_image/1'
+# Layer used for the content representation.
+CONTENT_LAYER = 'conv4_2'
+# Layers used for the style representation and their weights.
+STYLE_LAYERS = [
+    ('conv1_1', 0.5),
+    ('conv2_1', 1.0),
+    ('conv3_1', 1.5),
+    ('conv4_1', 3.0),
+    ('conv5_1', 4.0),
+]
+
+# Precision the network computes in. The layers given to the losses are
+# float32 whatever the precision, so gram matrices and losses are always
+# accumulated in float32.
+MODEL_PRECISION = 'float32'
+MODEL_PRECISIONS = {
+    'float32': tf.float32,
+    'float16': tf.float16,
+    'bfloat16': tf.bfloat16,
+}
+
+# Low memory mode of the gradient. The backward pass needs the activations
+# of every layer, which are held since the forward pass, so memory grows
+# with the number of pixels times the number of layers. With recomputation
+# only the outputs of the pooling layers, and of the layers the losses use,
+# are held; the layers between them are run again when the backward pass
+# reaches them. This costs up to one more forward pass per step, see
+# benchmark.memory_report.
+RECOMPUTE_GRADIENTS = False
+
+# Layers of the model in network order, with their index in the VGG file.
+VGG_LAYERS = [
+    ('conv1_1', 0), ('conv1_2', 2), ('avgpool1', 4),
+    ('conv2_1', 5), ('conv2_2', 7), ('avgpool2', 9),
+    ('conv3_1', 10), ('conv3_2', 12), ('conv3_3', 14), ('conv3_4', 16), ('avgpool3', 18),
+    ('conv4_1', 19), ('conv4_2', 21), ('conv4_3', 23), ('conv4_4', 25), ('avgpool4', 27),
+    ('conv5_1', 28), ('conv5_2', 30), ('conv5_3', 32), ('conv5_4', 34), ('avgpool5', 36),
+]
+
+
+def model_layers(content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS):
+    """
+    Returns the names of the layers the content and style losses need.
+    """
+    return [content_layer] + [layer_name for layer_name, _ in style_layers]
+
+
+def load_vgg_weights(path):
+    """
+    Returns a dict from conv layer name to (index, W, b).
+    path is either a weight store folder made by vgg_helper.mat2npy, whose
+    arrays are memory mapped so only the layers used are read from disk, or
+    a .pkl file made by vgg_helper.mat2pkl.
+    """
+    if os.path.isdir(path):
+        return load_weight_store(path)
+    vgg = pickle.load(open(path, "rb"))
+    weights = {}
+    for layer_index, layer in enumerate(vgg['layers']):
+        if layer['type'] == 'conv':
+            weights[str(layer['name'])] = (
+                layer_index, layer['weights']['W'], layer['weights']['b'])
+    return weights
+
+
+def load_vgg_model(path, layers=None, batch_size=1, height=None, width=None,
+                   constants=None, precision=MODEL_PRECISION, recompute=RECOMPUTE_GRADIENTS,
+                   input_tensor=None):
+    """
+    Returns a model for the purpose of 'painting' the picture.
+    Takes only the convolution layer weights and wrap using the TensorFlow
+    Conv2d, Relu and AveragePooling layer. VGG actually uses maxpool but
+    the paper indicates that using AveragePooling yields better results.
+    The last few fully connected layers are not used.
+    path is either a weight store folder made by vgg_helper.mat2npy, a
+    .pkl file made by vgg_helper.mat2pkl, or the dict returned by
+    load_vgg_weights so that several models can share loaded weights.
+    layers is the list of layer names needed, see model_layers. The model is
+    built only up to the deepest of them and the weights of deeper layers are
+    never loaded. None builds every layer up to avgpool5.
+    batch_size is the number of images held by the 'input' variable, so
+    that several images can be painted in one optimization.
+    height and width default to IMAGE_HEIGHT and IMAGE_WIDTH.
+    precision is one of MODEL_PRECISIONS. In reduced precision the weights
+    and the activations flowing through the network are float16 or
+    bfloat16, while the layers of the returned dict are cast back to
+    float32. Weights of any store precision can be used in any precision.
+    recompute trades compute for memory in the gradient of the 'input'
+    tower, see RECOMPUTE_GRADIENTS. The model then only holds the layers
+    named in layers and the pooling layers.
+    constants is a dict of the weight tensors already built in the current
+    graph; models built in one graph with the same dict share their weights.
+    Besides the layers fed by the 'input' variable, the model holds a second
+    tower under 'extract', fed by the 'extract_input' placeholder, which
+    shares the same weights and is used by extract_targets to get the
+    targets of several images in a single forward pass.
+    Here is the detailed configuration of the VGG model:
+        0 is conv1_1 (3, 3, 3, 64)
+        1 is relu
+        2 is conv1_2 (3, 3, 64, 64)
+        3 is relu
+        4 is maxpool
+        5 is conv2_1 (3, 3, 64, 128)
+        6 is relu
+        7 is conv2_2 (3, 3, 128, 128)
+        8 is relu
+        9 is maxpool
+        10 is conv3_1 (3, 3, 128, 256)
+        11 is relu
+        12 is conv3_2 (3, 3, 256, 256)
+        13 is relu
+        14 is conv3_3 (3, 3, 256, 256)
+        15 is relu
+        16 is conv3_4 (3, 3, 256, 256)
+        17 is relu
+        18 is maxpool
+        19 is conv4_1 (3, 3, 256, 512)
+        20 is relu
+        21 is conv4_2 (3, 3, 512, 512)
+        22 is relu
+        23 is conv4_3 (3, 3, 512, 512)
+        24 is relu
+        25 is conv4_4 (3, 3, 512, 512)
+        26 is relu
+        27 is maxpool
+        28 is conv5_1 (3, 3, 512, 512)
+        29 is relu
+        30 is conv5_2 (3, 3, 512, 512)
+        31 is relu
+        32 is conv5_3 (3, 3, 512, 512)
+        33 is relu
+        34 is conv5_4 (3, 3, 512, 512)
+        35 is relu
+        36 is maxpool
+        37 is fullyconnected (7, 7, 512, 4096)
+        38 is relu
+        39 is fullyconnected (1, 1, 4096, 4096)
+        40 is relu
+        41 is fullyconnected (1, 1, 4096, 1000)
+        42 is softmax
+    """
+    if isinstance(path, dict):
+        weights = path
+    else:
+        weights = load_vgg_weights(path)
+    # Weight and bias constants, created once and shared by both towers,
+    # and by every model given the same constants dict.
+    if constants is None:
+        constants = {}
+
+    def _weights(layer, expected_layer_name):
+        """
+        Return the weights and bias from the VGG model for a given layer.
+        """
+        layer_index, W, b = weights[expected_layer_name]
+        assert layer_index == layer
+        return W, b
+
+    def _relu(conv2d_layer):
+        """
+        Return the RELU function wrapped over a TensorFlow layer. Expects a
+        Conv2d layer input.
+        """
+        return tf.nn.relu(conv2d_layer)
+
+    def _conv2d(prev_layer, layer, layer_name):
+        """
+        Return the Conv2D layer using the weights, biases from the VGG
+        model at 'layer'.
+        """
+        # Models of different precisions may share the constants dict.
+        key = layer_name if precision == 'float32' else (layer_name, precision)
+        if key not in constants:
+            W, b = _weights(layer, layer_name)
+            W = tf.constant(np.asarray(W, dtype=np.float32), dtype=dtype)
+            b = tf.constant(np.reshape(np.asarray(b, dtype=np.float32), (b.size)), dtype=dtype)
+            constants[key] = (W, b)
+        W, b = constants[key]
+        return tf.nn.conv2d(
+            prev_layer, filter=W, strides=[1, 1, 1, 1], padding='SAME') + b
+
+    def _conv2d_relu(prev_layer, layer, layer_name):
+        """
+        Return the Conv2D + RELU layer using the weights, biases from the VGG
+        model at 'layer'.
+        """
+        return _relu(_conv2d(prev_layer, layer, layer_name))
+
+    def _avgpool(prev_layer):
+        """
+        Return the AveragePooling layer.
+        """
+        return tf.nn.avg_pool(prev_layer, ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME')
+
+    def _layers(prev_layer, block):
+        """
+        Return the outputs of the (layer name, layer) pairs of block run one
+        after another from prev_layer.
+        """
+        outputs = []
+        for layer_name, layer in block:
+            # Every layer gets its own name scope so that profiles can be
+            # grouped by layer.
+            with tf.name_scope(layer_name):
+                if layer_name.startswith('conv'):
+                    prev_layer = _conv2d_relu(prev_layer, layer, layer_name)
+                else:
+                    prev_layer = _avgpool(prev_layer)
+            outputs.append(prev_layer)
+        return outputs
+
+    def _recomputed_layers(prev_layer, block, kept):
+        """
+        Return the outputs of the layers of block named in kept, computed
+        like _layers, with a gradient that runs the block again from
+        prev_layer instead of holding its activations since the forward
+        pass.
+        """
+        kept_indices = [n for n, (layer_name, _) in enumerate(block) if layer_name in kept]
+
+        @tf.custom_gradient
+        def _block(block_input):
+            outputs = _layers(block_input, block)
+
+            def _gradient(*output_gradients):
+                # The block only runs again once the gradients reach it.
+                with tf.control_dependencies(output_gradients):
+                    recomputed_input = tf.identity(block_input)
+                recomputed = _layers(recomputed_input, block)
+                return tf.gradients([recomputed[n] for n in kept_indices], recomputed_input,
+                                    grad_ys=list(output_gradients))[0]
+
+            return [outputs[n] for n in kept_indices], _gradient
+
+        return dict(zip([block[n][0] for n in kept_indices], _block(prev_layer)))
+
+    def _network(input_layer, recompute=False):
+        """
+        Return the dict of VGG layers computed from input_layer, stopping
+        at the deepest layer needed. With recompute the network is split
+        into blocks ending at the pooling layers and at the requested
+        layers, which the losses hold anyway, and only the outputs of the
+        blocks are kept for the backward pass, see RECOMPUTE_GRADIENTS.
+        """
+        prev_layer = input_layer
+        if dtype != tf.float32:
+            prev_layer = tf.cast(input_layer, dtype)
+        kept = set(layer_names if layers is None else layers)
+        blocks = [[]]
+        for layer_name, layer in VGG_LAYERS[:depth]:
+            blocks[-1].append((layer_name, layer))
+            if layer_name.startswith('avgpool') or (recompute and layer_name in kept):
+                blocks.append([])
+        outputs = {}
+        for block in blocks:
+            if not block:
+                continue
+            if recompute and len(block) > 1:
+                outputs.update(_recomputed_layers(prev_layer, block,
+                                                  kept | set([block[-1][0]])))
+            else:
+                outputs.update(zip([layer_name for layer_name, _ in block],
+                                   _layers(prev_layer, block)))
+            prev_layer = outputs[block[-1][0]]
+        # Only the casts of the layers the losses use ever run.
+        net = {}
+        for layer_name, output in outputs.items():
+            with tf.name_scope(layer_name):
+                net[layer_name] = output if dtype == tf.float32 else tf.cast(output, tf.float32)
+        return net
+
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError('Unknown precision %s' % precision)
+    dtype = MODEL_PRECISIONS[precision]
+
+    # Only build, and load weights, up to the deepest requested layer.
+    layer_names = [layer_name for layer_name, _ in VGG_LAYERS]
+    if layers is None:
+        depth = len(VGG_LAYERS)
+    else:
+        depth = max(layer_names.index(layer_name) for layer_name in layers) + 1
+
+    if height is None:
+        height = IMAGE_HEIGHT
+    if width is None:
+        width = IMAGE_WIDTH
+
+    # Constructs the graph model.
+    graph = {}
+    if input_tensor is None:
+        graph['input']   = tf.Variable(np.zeros((batch_size, height, width, COLOR_CHANNELS)), dtype = 'float32')
+    else:
+        graph['input'] = input_tensor
+        height, width = input_tensor.get_shape().as_list()[1:3]
+    graph.update(_network(graph['input'], recompute))
+    # Constructs the extraction tower, any number of images can be fed.
+    graph['extract_input'] = tf.placeholder('float32', (None, height, width, COLOR_CHANNELS))
+    with tf.name_scope('extract'):
+        graph['extract'] = _network(graph['extract_input'])
+    return graph
+
+
+def gram_matrix(F, N, M):
+    """
+    The gram matrix G.
+    """
+    with tf.name_scope('gram'):
+        Ft = tf.reshape(F, (M, N))
+        return tf.matmul(tf.transpose(Ft), Ft)
+
+
+def batch_gram_matrix(F):
+    """
+    The gram matrices of every image in a batch of feature maps F,
+    with shape (batch, N, N).
+    """
+    N = F.get_shape().as_list()[3]
+    with tf.name_scope('gram'):
+        Ft = tf.reshape(F, (tf.shape(F)[0], -1, N))
+        return tf.matmul(Ft, Ft, transpose_a=True)
+
+
+def extract_gram_ops(model, style_layers):
+    """
+    Returns the gram matrix ops of the extraction tower at style_layers.
+    The ops are built once and kept in the model so that repeated
+    extractions do not grow the graph; call it before finalizing a graph
+    whose targets are extracted later.
+    """
+    if 'extract_grams' not in model:
+        model['extract_grams'] = {}
+    for layer_name, _ in style_layers:
+        if layer_name not in model['extract_grams']:
+            model['extract_grams'][layer_name] = batch_gram_matrix(model['extract'][layer_name])
+    return [model['extract_grams'][layer_name] for layer_name, _ in style_layers]
+
+
+def extract_style_grams(sess, model, style_images, style_layers=STYLE_LAYERS):
+    """
+    Returns one gram matrix per style layer with shape (K, N, N) holding
+    the target of every one of the K style_images, e.g. the styles of the
+    regions of a masked style transfer. The style images must have the size
+    of the model and go through the extraction tower in one forward pass.
+    """
+    batch = np.concatenate(list(style_images), axis=0)
+    return sess.run(extract_gram_ops(model, style_layers),
+                    feed_dict={model['extract_input']: batch})
+
+
+def layer_masks(masks, layer_name):
+    """
+    Returns region masks of shape (K, H, W, 1) brought to the resolution of
+    layer_name by the same average pooling as the network, so that hard
+    masks become soft along the region borders of deeper layers.
+    """
+    masks = tf.convert_to_tensor(masks, dtype=tf.float32)
+    for name, _ in VGG_LAYERS:
+        if name == layer_name:
+            break
+        if name.startswith('avgpool'):
+            masks = tf.nn.avg_pool(masks, ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME')
+    return masks
+
+
+def extract_batch_targets(sess, model, content_images, style_images,
+                          content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS):
+    """
+    Returns the content features of every content image, with shape
+    (batch, h, w, N), and one gram matrix per style layer with shape
+    (batch, N, N) holding the target of every image.
+    content_images is an array of shape (batch, H, W, 3) and style_images a
+    list with one style image per content image. Style images used by more
+    than one content image are only run once, and everything goes through
+    the extraction tower in a single forward pass.
+    """
+    extract = model['extract']
+    gram_fetches = extract_gram_ops(model, style_layers)
+
+    # Position of the style of every content image among the unique styles.
+    unique_styles = []
+    style_digests = []
+    style_index = []
+    for style_image in style_images:
+        digest = hashlib.sha1(np.ascontiguousarray(style_image).tobytes()).hexdigest()
+        if digest not in style_digests:
+            style_digests.append(digest)
+            unique_styles.append(style_image)
+        style_index.append(style_digests.index(digest))
+
+    n_content = content_images.shape[0]
+    batch = np.concatenate([content_images] + unique_styles, axis=0)
+    features, batch_grams = sess.run(
+        [extract[content_layer], gram_fetches],
+        feed_dict={model['extract_input']: batch})
+    content_features = features[:n_content]
+    grams = [gram[n_content:][style_index] for gram in batch_grams]
+    return content_features, grams
+
+
+def style_grams(sess, model, style_layers=STYLE_LAYERS):
+    """
+    Returns the gram matrices of the model's current input at style_layers.
+    """
+    grams = []
+    for layer_name, _ in style_layers:
+        x = model[layer_name]
+        _, height, width, N = x.get_shape().as_list()
+        M = height * width
+        grams.append(gram_matrix(x, N, M))
+    return sess.run(grams)
+
+
+def extract_targets(sess, model, content_image, style_image,
+                    content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS):
+    """
+    Returns the content features and the style gram matrices in one run.
+    Content and style images of the same size go through the extraction
+    tower as a batch of two, so every requested layer of both images costs
+    a single forward pass. Images of different sizes need one pass each.
+    Either image may be None if its targets are not needed.
+    """
+    extract = model['extract']
+    gram_fetches = extract_gram_ops(model, style_layers)
+
+    content_features = None
+    grams = None
+    if (content_image is not None and style_image is not None
+            and content_image.shape == style_image.shape):
+        batch = np.concatenate([content_image, style_image], axis=0)
+        features, batch_grams = sess.run(
+            [extract[content_layer], gram_fetches],
+            feed_dict={model['extract_input']: batch})
+        content_features = features[:1]
+        grams = [gram[1] for gram in batch_grams]
+    else:
+        if content_image is not None:
+            content_features = sess.run(
+                extract[content_layer],
+                feed_dict={model['extract_input']: content_image})
+        if style_image is not None:
+            grams = [gram[0] for gram in sess.run(
+                gram_fetches, feed_dict={model['extract_input']: style_image})]
+    return content_features, grams
+
+
+def content_loss_func(sess, model, content_features=None, content_layer=CONTENT_LAYER,
+                      per_image=False):
+    """
+    Content loss function as defined in the paper.
+    If content_features is given it is used as the target instead of
+    running the model on its current input. For a model holding several
+    images content_features holds one target per image and the loss is
+    summed over the images, or with per_image returned as one loss per
+    image. content_features may also be a tensor, so that the target can
+    be changed without building a new loss.
+    """
+    def _content_loss(p, x):
+        # N is the number of filters (at layer l).
+        N = x.get_shape().as_list()[3]
+        # M is the height times the width of the feature map (at layer l).
+        M = x.get_shape().as_list()[1] * x.get_shape().as_list()[2]
+        # Interestingly, the paper uses this form instead:
+        #
+        #   0.5 * tf.reduce_sum(tf.pow(x - p, 2))
+        #
+        # But this form is very slow in "painting" and thus could be missing
+        # out some constants (from what I see in other source code), so I'll
+        # replicate the same normalization constant as used in style loss.
+        return (1 / (4 * N * M)) * tf.reduce_sum(tf.pow(x - p, 2),
+                                                 axis=[1, 2, 3] if per_image else None)
+    if content_features is None:
+        content_features = sess.run(model[content_layer])
+    with tf.name_scope('content_loss'):
+        return _content_loss(content_features, model[content_layer])
+
+
+def style_loss_func(sess, model, grams=None, style_layers=STYLE_LAYERS,
+                    return_layer_losses=False, masks=None, per_image=False):
+    """
+    Style loss function as defined in the paper.
+    If grams is given, one gram matrix per entry of style_layers, they are
+    used as the targets instead of running the model on its current input.
+    For a model holding several images each gram matrix may have shape
+    (batch, N, N), one target per image, and the loss is summed over the
+    images; a single (N, N) target is shared by all images. The gram
+    matrices may also be tensors.
+    With return_layer_losses a dict from layer name to its weighted term
+    is returned along with the loss. With per_image every loss holds one
+    value per image of the model instead of their sum, and a layer weight
+    may hold one value per image as well.
+    With masks, an array or tensor of shape (K, H, W, 1) holding K region
+    masks of the model's input, every gram matrix has shape (K, N, N) and
+    holds the style target of every region: the K styles are painted in
+    their regions by the same optimization. Each region's gram matrix is
+    computed from the feature map weighted by its mask at the layer's
+    resolution, see layer_masks, and is compared to its target scaled to
+    the region's area.
+    """
+    def _style_loss(A, x):
+        """
+        The style loss calculation.
+        """
+        # N is the number of filters (at layer l).
+        N = x.get_shape().as_list()[3]
+        # M is the height times the width of the feature map (at layer l).
+        M = x.get_shape().as_list()[1] * x.get_shape().as_list()[2]
+        # A is the style representation of the original image (at layer l).
+        if isinstance(A, np.ndarray):
+            A = tf.constant(A)
+        # G is the style representation of the generated image (at layer l).
+        if x.get_shape().as_list()[0] == 1 and A.get_shape().ndims == 2 and not per_image:
+            G = gram_matrix(x, N, M)
+        else:
+            G = batch_gram_matrix(x)
+        result = (1 / (4 * N**2 * M**2)) * tf.reduce_sum(tf.pow(G - A, 2),
+                                                          axis=[1, 2] if per_image else None)
+        return result
+
+    def _masked_style_loss(A, x, mask):
+        """
+        The style loss of every region, summed.
+        """
+        N = x.get_shape().as_list()[3]
+        M = x.get_shape().as_list()[1] * x.get_shape().as_list()[2]
+        if isinstance(A, np.ndarray):
+            A = tf.constant(A)
+        # G holds the gram matrix of every region, with shape (K, N, N).
+        G = batch_gram_matrix(x * mask)
+        # M of every region is its area, the targets are scaled from the
+        # area of the whole style image to it.
+        area = tf.maximum(tf.reduce_sum(mask, axis=[1, 2, 3]), 1e-6)
+        A = A * tf.reshape(area / M, (-1, 1, 1))
+        E = tf.reduce_sum(tf.pow(G - A, 2), axis=[1, 2]) / (4 * N**2 * tf.square(area))
+        # Every region weighs its share of the image, so a region covering
+        # the whole image has the loss of an unmasked style and an empty
+        # one has none.
+        return tf.reduce_sum(E * area / M)
+
+    if grams is None:
+        if masks is not None:
+            raise ValueError('Masked style loss needs the gram matrices of every region')
+        grams = style_grams(sess, model, style_layers)
+    if masks is not None and model['input'].get_shape().as_list()[0] != 1:
+        raise ValueError('Masked style loss needs a model holding a single image')
+    if masks is not None and per_image:
+        raise ValueError('Masked style loss is not computed per image')
+    E = []
+    with tf.name_scope('style_loss'):
+        for l, (layer_name, _) in enumerate(style_layers):
+            with tf.name_scope(layer_name):
+                if masks is None:
+                    E.append(_style_loss(grams[l], model[layer_name]))
+                else:
+                    mask = layer_masks(masks, layer_name)
+                    E.append(_masked_style_loss(grams[l], model[layer_name], mask))
+    W = [w for _, w in style_layers]
+    loss = sum([W[l] * E[l] for l in range(len(style_layers))])
+    if return_layer_losses:
+        return loss, dict((layer_name, W[l] * E[l]) for l, (layer_name, _) in enumerate(style_layers))
+    return loss
+
+
+def generate_noise_image(content_image, noise_ratio = NOISE_RATIO):
+    """
+    Returns a noise image intermixed with the content image at a certain ratio.
+    """
+    noise_image = np.random.uniform(
+            -20, 20,
+            content_image.shape).astype('float32')
+    # White noise image from the content representation. Take a weighted average
+    # of the values
+    input_image = noise_image * noise_ratio + content_image * (1 - noise_ratio)
+    return input_image
+
+
+def resize_image(image, height, width):
+    """
+    Returns a batch of images resized to height x width with bilinear
+    interpolation. Works on mean subtracted images as well.
+    """
+    _, image_height, image_width, _ = image.shape
+    if (image_height, image_width) == (height, width):
+        return image
+    zoom = (1, float(height) / image_height, float(width) / image_width, 1)
+    resized = scipy.ndimage.zoom(image, zoom, order=1)
+    # zoom rounds the output size, make sure it matches exactly.
+    return resized[:, :height, :width, :]
+
+
+def fitted_size(image_height, image_width, height, width, policy=RESIZE_POLICY):
+    """
+    Returns the size an image of image_height x image_width is resized to
+    before fit_image pads or crops it to height x width.
+    'resize' stretches the image to the new size, 'pad' keeps the aspect
+    ratio and fits the image inside it, 'crop' keeps the aspect ratio and
+    covers it.
+    """
+    if policy == 'resize':
+        return height, width
+    elif policy in ('pad', 'crop'):
+        scale_height = float(height) / image_height
+        scale_width = float(width) / image_width
+        if policy == 'pad':
+            scale = min(scale_height, scale_width)
+        else:
+            scale = max(scale_height, scale_width)
+        new_height = int(round(image_height * scale))
+        new_width = int(round(image_width * scale))
+        # Rounding must not make the image overflow (pad) or fall short
+        # (crop) of the new size.
+        if policy == 'pad':
+            new_height = min(max(new_height, 1), height)
+            new_width = min(max(new_width, 1), width)
+        else:
+            new_height = max(new_height, height)
+            new_width = max(new_width, width)
+        return new_height, new_width
+    else:
+        raise ValueError('Unknown resize policy %s' % policy)
+
+
+def place_image(image, height, width, policy=RESIZE_POLICY):
+    """
+    Returns a mean subtracted image of the size given by fitted_size padded
+    with the mean color ('pad') or cropped evenly ('crop') to height x width.
+    """
+    _, image_height, image_width, channels = image.shape
+    if (image_height, image_width) == (height, width):
+        return image
+    top = abs(image_height - height) // 2
+    left = abs(image_width - width) // 2
+    if policy == 'crop':
+        return image[:, top:top + height, left:left + width, :]
+    # Zero is the mean color once the mean is subtracted.
+    fitted = np.zeros((1, height, width, channels), dtype=image.dtype)
+    fitted[:, top:top + image_height, left:left + image_width, :] = image
+    return fitted
+
+
+def fit_image(image, height, width, policy=RESIZE_POLICY):
+    """
+    Returns a mean subtracted image brought to height x width following
+    policy, see fitted_size.
+    """
+    _, image_height, image_width, _ = image.shape
+    if (image_height, image_width) == (height, width):
+        return image
+    new_height, new_width = fitted_size(image_height, image_width, height, width, policy)
+    image = resize_image(image, new_height, new_width)
+    return place_image(image, height, width, policy)
+
+
+def read_image(path, mode='RGB'):
+    """
+    Returns the uint8 pixels of the image at path, with shape (H, W, 3) in
+    'RGB' mode and (H, W) in 'L' (grayscale) mode.
+    """
+    with Image.open(path) as picture:
+        return np.asarray(picture.convert(mode))
+
+
+def load_image(path, height=None, width=None, policy=RESIZE_POLICY):
+    """
+    Returns the image at path as a float32 mean subtracted batch of one.
+    If height and width are given the image is brought to that size
+    following policy, see fit_image. ingest.Ingest loads images in the
+    background and caches them.
+    """
+    image = read_image(path)
+    # Resize the image for convnet input, there is no change but just
+    # add an extra dimension.
+    image = np.reshape(image, ((1,) + image.shape))
+    # Input to the VGG model expects the mean to be subtracted.
+    image = image.astype(np.float32) - MEAN_VALUES.astype(np.float32)
+    if height is not None and width is not None:
+        image = fit_image(image, height, width, policy)
+    return image
+
+
+def load_mask(path, height=None, width=None, policy=RESIZE_POLICY):
+    """
+    Returns the grayscale mask at path, e.g. a Grabcut segmentation, with
+    values within 0 and 1 and shape (1, H, W, 1). If height and width are
+    given the mask is brought to that size following policy like the
+    images; padded borders are outside the region.
+    """
+    mask = read_image(path, 'L').astype('float32') / 255
+    mask = np.reshape(mask, (1,) + mask.shape + (1,))
+    if height is not None and width is not None:
+        mask = fit_image(mask, height, width, policy)
+    return mask
+
+
+def deprocess_image(image):
+    """
+    Returns the uint8 (H, W, 3) picture of a mean subtracted image.
+    """
+    # Output should add back the mean.
+    image = image + MEAN_VALUES
+    # Get rid of the first useless dimension, what remains is the image.
+    image = image[0]
+    return np.clip(image, 0, 255).astype('uint8')
+
+
+def save_image(path, image):
+    Image.fromarray(deprocess_image(image)).save(path)
@@ -0,0 +1,135 @@
+# This script paints the frames of a clip, each frame starting from the
+# painted previous frame instead of from noise
+#
+# usage: python video.py frames/ images/guernica.jpg output/frames/
+#                        [--model imagenet-vgg-verydeep-19/]
+import os
+import sys
+import argparse
+import tensorflow as tf
+from PIL import Image
+
+from vgg_model import load_vgg_model, load_image, model_layers, extract_targets, resize_image
+from vgg_model import generate_noise_image, CONTENT_LAYER, STYLE_LAYERS, NOISE_RATIO
+from stylize import Targets, loss_terms_func, AdamPainter
+from stylize import ALPHA, BETA, ITERATIONS
+from image_writer import ImageWriter
+from ingest import Ingest, list_images
+
+
+# Number of frames loaded ahead of the one being painted.
+PREFETCH_FRAMES = 4
+# Maximum number of iterations of the first frame, painted from noise, and
+# of the following frames, painted from the previous one.
+FIRST_FRAME_ITERATIONS = ITERATIONS
+FRAME_ITERATIONS = 100
+# A frame stops early once its loss changed by less than FRAME_TOLERANCE
+# between two checks, or once it is within FRAME_LOSS_MARGIN of the final
+# loss of the first frame.
+FRAME_TOLERANCE = 1e-3
+FRAME_LOSS_MARGIN = 0.05
+# Share of the new frame's content mixed into the previous painted frame
+# to start from; 0 starts from the previous painted frame as is.
+CONTENT_BLEND = 0.1
+
+
+def stylize_frames(model_path, frame_paths, style_image, output_dir,
+                   height=None, width=None, first_iterations=FIRST_FRAME_ITERATIONS,
+                   iterations=FRAME_ITERATIONS, tolerance=FRAME_TOLERANCE,
+                   loss_margin=FRAME_LOSS_MARGIN, content_blend=CONTENT_BLEND,
+                   alpha=ALPHA, beta=BETA, noise_ratio=NOISE_RATIO,
+                   content_layer=CONTENT_LAYER, style_layers=STYLE_LAYERS,
+                   observers=(), writer=None):
+    """
+    Paints every frame of frame_paths and writes it to output_dir under the
+    frame's name. Returns the painter's info of every frame. frame_paths
+    is a folder of frames, see ingest.list_images, or a list of their paths.
+    The model, loss and painter are built once and the style gram matrices
+    computed once; every frame only loads its content target. The first
+    frame is painted from noise, every following one starts from the
+    previous painted frame, blended by content_blend towards the new
+    frame, and stops early, see FRAME_TOLERANCE, so it needs a fraction of
+    the iterations of a cold start. Its target loss is set from the final
+    loss of the first frame, so the loss of the clip does not drift from
+    frame to frame. Frames are brought to height x width, by default the
+    size of the first frame.
+    """
+    if isinstance(frame_paths, str):
+        frame_paths = list_images(frame_paths)
+    if height is None or width is None:
+        with Image.open(frame_paths[0]) as picture:
+            width, height = picture.size
+    style_image = resize_image(style_image, height, width)
+    own_writer = writer is None
+    if own_writer:
+        writer = ImageWriter()
+    # Frames are painted once, caching them would only fill the disk.
+    ingest = Ingest(height, width, use_cache=False)
+
+    infos = []
+    sess = None
+    graph = tf.Graph()
+    try:
+        with graph.as_default():
+            model = load_vgg_model(model_path, model_layers(content_layer, style_layers),
+                                   1, height, width)
+            sess = tf.Session()
+            sess.run(model['input'].initializer)
+            _, grams = extract_targets(sess, model, None, style_image, content_layer, style_layers)
+            targets = Targets(model, content_layer, style_layers)
+            loss_terms = loss_terms_func(sess, model, targets.content, targets.grams, alpha, beta,
+                                         content_layer, style_layers)
+            painter = AdamPainter(sess, model, loss_terms)
+            graph.finalize()
+        mixed_image = None
+        target_loss = None
+        for path, content_image in ingest.stream(frame_paths, PREFETCH_FRAMES):
+            content_features, _ = extract_targets(sess, model, content_image, None,
+                                                  content_layer, style_layers)
+            targets.load(sess, content_features, grams)
+            if mixed_image is None:
+                mixed_image = painter.run(generate_noise_image(content_image, noise_ratio),
+                                          first_iterations, observers, tolerance=tolerance)
+                # Every following frame is held to the first frame's loss,
+                # not to the previous one's, which would let it drift.
+                target_loss = painter.info['loss'] * (1 + loss_margin)
+            else:
+                initial_image = (1 - content_blend) * mixed_image + content_blend * content_image
+                mixed_image = painter.run(initial_image, iterations, observers,
+                                          tolerance=tolerance, target_loss=target_loss)
+            info = dict(painter.info)
+            info['frame'] = path
+            infos.append(info)
+            name = os.path.splitext(os.path.basename(path))[0] + '.png'
+            # The next frame paints into the same variable, but the
+            # painted image returned is a copy.
+            writer.submit(os.path.join(output_dir, name), mixed_image, block=True)
+    finally:
+        ingest.close()
+        if sess is not None:
+            sess.close()
+        if own_writer:
+            writer.close()
+    return infos
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Paint the frames of a clip.')
+    parser.add_argument('frames', help='folder of the frames')
+    parser.add_argument('style', help='style image')
+    parser.add_argument('output', help='folder of the painted frames')
+    parser.add_argument('--model', default='imagenet-vgg-verydeep-19/',
+                        help='vgg weight store folder or .pkl file')
+    parser.add_argument('--iterations', type=int, default=FRAME_ITERATIONS,
+                        help='maximum iterations of every frame after the first')
+    args = parser.parse_args()
+
+    frame_paths = list_images(args.frames)
+    if not frame_paths:
+        sys.exit('No frames in %s' % args.frames)
+    infos = stylize_frames(args.model, frame_paths, load_image(args.style), args.output,
+                           iterations=args.iterations)
+    for info in infos:
+        print('%s: %d iterations, %.1fs, %s' % (
+            os.path.basename(info['frame']), info['iterations'], info['seconds'],
+            info['stop_reason']))
@@ -0,0 +1,302 @@
+# This script runs a long lived worker that keeps the model warm and paints
+# the jobs dropped in a queue folder one after another
+#
+# usage: python worker.py [--queue queue/] [--once] [vgg model]
+#
+# A job is a .json file in <queue>/pending/, see submit_job. While it runs
+# it is moved to <queue>/running/, and once done its record, holding the
+# job, its status and timings, is written to <queue>/done/ or
+# <queue>/failed/.
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import traceback
+
+from vgg_model import model_layers, extract_targets
+from vgg_model import CONTENT_LAYER, STYLE_LAYERS, NOISE_RATIO, IMAGE_HEIGHT, IMAGE_WIDTH, RESIZE_POLICY
+from vgg_model import generate_noise_image
+from stylize import Targets, LossWeights, loss_terms_func, make_painter
+from stylize import ALPHA, BETA, ITERATIONS
+from model_cache import ModelCache
+from feature_cache import FeatureCache, CACHE_DIR, CACHE_MAX_BYTES
+from image_writer import ImageWriter
+from progress import HistoryObserver
+from ingest import Ingest, PREPROCESSING, INGEST_CACHE_MAX_BYTES
+from checkpoint import CHECKPOINT_EVERY
+
+
+# Default vgg model and queue folder.
+VGG_MODEL = 'imagenet-vgg-verydeep-19/'
+QUEUE_DIR = 'queue/'
+# Seconds to wait before looking at an empty queue again.
+POLL_INTERVAL = 1.0
+# Values used for the settings a job does not give.
+JOB_DEFAULTS = {
+    'alpha': ALPHA,
+    'beta': BETA,
+    'style_layers': STYLE_LAYERS,
+    'iterations': ITERATIONS,
+    'noise_ratio': NOISE_RATIO,
+    'optimizer': 'adam',
+    'height': IMAGE_HEIGHT,
+    'width': IMAGE_WIDTH,
+    'resize_policy': RESIZE_POLICY,
+    # Path of the job's checkpoint, see checkpoint.py. A job whose
+    # checkpoint exists goes on from it, e.g. after the worker was stopped
+    # or to give a finished job more iterations.
+    'checkpoint': None,
+    'checkpoint_every': CHECKPOINT_EVERY,
+}
+
+
+def submit_job(content, style, output, queue_dir=QUEUE_DIR, **settings):
+    """
+    Drops a job in the queue and returns its id. settings override
+    JOB_DEFAULTS, e.g. alpha=50 or iterations=1000.
+    """
+    job = {'content': content, 'style': style, 'output': output}
+    job.update(settings)
+    job['id'] = job.get('id') or uuid.uuid4().hex
+    pending_dir = os.path.join(queue_dir, 'pending')
+    if not os.path.exists(pending_dir):
+        os.makedirs(pending_dir)
+    path = os.path.join(pending_dir, job['id'] + '.json')
+    # Write to a temporary name first so the worker never reads half a job.
+    with open(path + '.tmp', 'w') as f:
+        json.dump(job, f)
+    os.replace(path + '.tmp', path)
+    return job['id']
+
+
+class StylizeWorker(object):
+    """
+    Paints jobs back to back with warm models, in a session created with
+    config, a tf.ConfigProto.
+    The weights are loaded once, models for every image size are kept by a
+    model_cache.ModelCache, and the loss and optimizer built for a model,
+    style layers and optimizer are reused by later jobs, with the targets
+    and loss weights of every job loaded into their variables. Targets are
+    read from the feature cache when the same image was seen before, and
+    the images decoded by an ingest.Ingest, from its cache in the images
+    folder of cache_dir, within image_cache_max_bytes.
+    """
+
+    def __init__(self, model_path=VGG_MODEL, queue_dir=QUEUE_DIR,
+                 use_feature_cache=True, cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES,
+                 config=None, image_cache_max_bytes=INGEST_CACHE_MAX_BYTES):
+        self.model_path = model_path
+        self.queue_dir = queue_dir
+        self.models = ModelCache(model_path, config=config)
+        self.features = FeatureCache(cache_dir, cache_max_bytes) if use_feature_cache else None
+        self.writer = ImageWriter()
+        # Preprocessed images are cached in the images folder of cache_dir.
+        self.ingest = Ingest(use_cache=use_feature_cache,
+                             cache_dir=os.path.join(cache_dir, 'images'),
+                             cache_max_bytes=image_cache_max_bytes)
+        # Without a queue folder jobs are only given to run_job.
+        if queue_dir is not None:
+            for name in ('pending', 'running', 'done', 'failed'):
+                path = os.path.join(queue_dir, name)
+                if not os.path.exists(path):
+                    os.makedirs(path)
+
+    def _painter(self, job, style_layers):
+        """
+        Returns the model, targets, loss weights and painter for the job's
+        size, style layers and optimizer. alpha, beta and the layer weights
+        are loaded into variables, so jobs differing only in them share one
+        painter.
+        """
+        layer_names = [layer_name for layer_name, _ in style_layers]
+        layers = model_layers(CONTENT_LAYER, style_layers)
+        model = self.models.get(job['height'], job['width'], layers)
+
+        def _build():
+            targets = Targets(model, CONTENT_LAYER, style_layers)
+            weights = LossWeights(layer_names)
+            loss_terms = loss_terms_func(self.models.sess, model, targets.content,
+                                         targets.grams, weights.alpha, weights.beta,
+                                         CONTENT_LAYER, weights.style_layers)
+            painter = make_painter(self.models.sess, model, loss_terms, job['optimizer'])
+            return model, targets, weights, painter
+
+        key = ('worker', tuple(layer_names), job['optimizer'])
+        return self.models.built(self.models.key(job['height'], job['width'], layers),
+                                 key, _build)
+
+    def _targets(self, job, model, content_image, style_image, style_layers):
+        """
+        Returns the content features and style gram matrices of the job,
+        from the feature cache when possible.
+        """
+        content_features = None
+        grams = None
+        if self.features is not None:
+            content_key = self.features.key(job['content'], content_image.shape,
+                                            CONTENT_LAYER, self.model_path, 'features',
+                                            job['resize_policy'], PREPROCESSING)
+            style_keys = [self.features.key(job['style'], style_image.shape,
+                                            layer_name, self.model_path, 'gram',
+                                            job['resize_policy'], PREPROCESSING)
+                          for layer_name, _ in style_layers]
+            content_features = self.features.get(content_key)
+            grams = self.features.get_many(style_keys)
+        if content_features is None or grams is None:
+            with self.models.graph.as_default():
+                extracted_features, extracted_grams = extract_targets(
+                    self.models.sess, model,
+                    content_image if content_features is None else None,
+                    style_image if grams is None else None,
+                    CONTENT_LAYER, style_layers)
+            if content_features is None:
+                content_features = extracted_features
+                if self.features is not None:
+                    self.features.put(content_key, content_features)
+            if grams is None:
+                grams = extracted_grams
+                if self.features is not None:
+                    for key, gram in zip(style_keys, grams):
+                        self.features.put(key, gram)
+        return content_features, grams
+
+    def run_job(self, job):
+        """
+        Paints one job and returns its record.
+        """
+        settings = dict(JOB_DEFAULTS)
+        settings.update(job)
+        job = settings
+        style_layers = [(str(layer_name), float(weight))
+                        for layer_name, weight in job['style_layers']]
+        timings = {}
+        start = time.time()
+
+        size = (job['height'], job['width'], job['resize_policy'])
+        content_future = self.ingest.submit(job['content'], *size)
+        style_image = self.ingest.load(job['style'], *size)
+        content_image = content_future.result()
+        timings['load'] = time.time() - start
+
+        mark = time.time()
+        model, targets, weights, painter = self._painter(job, style_layers)
+        timings['build'] = time.time() - mark
+
+        mark = time.time()
+        content_features, grams = self._targets(job, model, content_image, style_image, style_layers)
+        targets.load(self.models.sess, content_features, grams)
+        weights.load(self.models.sess, job['alpha'], job['beta'], style_layers)
+        timings['targets'] = time.time() - mark
+
+        mark = time.time()
+        iterations = job['iterations']
+        history = HistoryObserver()
+        checkpoint = job['checkpoint']
+        if checkpoint is None:
+            mixed_image = painter.run(generate_noise_image(content_image, job['noise_ratio']),
+                                      iterations, [history])
+        elif job['optimizer'] != 'adam':
+            raise ValueError('Checkpoints need the adam optimizer, not %s' % job['optimizer'])
+        elif os.path.exists(checkpoint):
+            mixed_image = painter.resume(checkpoint, iterations, [history],
+                                         checkpoint_every=job['checkpoint_every'])
+        else:
+            mixed_image = painter.run(generate_noise_image(content_image, job['noise_ratio']),
+                                      iterations, [history], checkpoint=checkpoint,
+                                      checkpoint_every=job['checkpoint_every'])
+        timings['paint'] = time.time() - mark
+
+        mark = time.time()
+        self.writer.submit(job['output'], mixed_image, block=True)
+        self.writer.flush()
+        timings['write'] = time.time() - mark
+        timings['total'] = time.time() - start
+
+        record = {'job': job, 'status': 'done', 'timings': timings,
+                  'loss': dict((name, float(value)) for name, value in history.final.items())}
+        info = getattr(painter, 'info', None)
+        if info is not None:
+            record['optimizer'] = info
+        return record
+
+    def _claim(self):
+        """
+        Moves the oldest pending job to running and returns its path there,
+        or None if the queue is empty.
+        """
+        pending_dir = os.path.join(self.queue_dir, 'pending')
+        names = [name for name in os.listdir(pending_dir) if name.endswith('.json')]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(pending_dir, name)))
+        for name in names:
+            running_path = os.path.join(self.queue_dir, 'running', name)
+            try:
+                # The rename is atomic, so two workers never claim one job.
+                os.rename(os.path.join(pending_dir, name), running_path)
+            except OSError:
+                continue
+            return running_path
+        return None
+
+    def poll(self):
+        """
+        Runs the pending jobs back to back and returns how many were run.
+        """
+        count = 0
+        while True:
+            running_path = self._claim()
+            if running_path is None:
+                return count
+            name = os.path.basename(running_path)
+            job = None
+            try:
+                with open(running_path) as f:
+                    job = json.load(f)
+                record = self.run_job(job)
+                status_dir = 'done'
+            except Exception:
+                record = {'job': job, 'status': 'failed',
+                          'error': traceback.format_exc()}
+                status_dir = 'failed'
+            with open(os.path.join(self.queue_dir, status_dir, name), 'w') as f:
+                json.dump(record, f, indent=1, sort_keys=True)
+            os.remove(running_path)
+            print('%s %s' % (record['status'], name))
+            count += 1
+
+    def serve_forever(self, poll_interval=POLL_INTERVAL):
+        """
+        Runs jobs as they arrive until interrupted.
+        """
+        while True:
+            if self.poll() == 0:
+                time.sleep(poll_interval)
+
+    def close(self):
+        self.writer.close()
+        self.ingest.close()
+        self.models.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Paint the jobs of a queue folder.')
+    parser.add_argument('model', nargs='?', default=VGG_MODEL,
+                        help='vgg weight store folder or .pkl file')
+    parser.add_argument('--queue', default=QUEUE_DIR, help='queue folder')
+    parser.add_argument('--once', action='store_true',
+                        help='exit once the queue is empty')
+    parser.add_argument('--no-feature-cache', action='store_true',
+                        help='always extract the targets')
+    args = parser.parse_args()
+
+    worker = StylizeWorker(args.model, args.queue, not args.no_feature_cache)
+    try:
+        if args.once:
+            worker.poll()
+        else:
+            worker.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+    finally:
+        worker.close()